@@ -5,11 +5,12 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
+Served by gunicorn with uvicorn workers, see gunicorn.conf.py.
 """
 
 import os
 
-from django.core.asgi import get_asgi_application
+from utility.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'brs.settings')
 
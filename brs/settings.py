@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -27,7 +28,8 @@ load_dotenv(dotenv_path=os.path.join(BASE_DIR, ".env"))
 SECRET_KEY = '030#)q5@46k@%g7-uo4np7h_0o7x9m+ce59imgxy90%902&+*o'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# With DEBUG on, {% static %} links the unhashed names even with the manifest storage
+DEBUG = os.getenv('DEBUG', 'true').lower() == 'true'
 
 ALLOWED_HOSTS = ['*']
 
@@ -46,11 +48,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'utility.perf.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'utility.replica.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -59,7 +63,8 @@ ROOT_URLCONF = 'brs.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates timing template rendering for utility.perf.PerformanceMiddleware
+        'BACKEND': 'utility.perf.TimedDjangoTemplates',
         'DIRS': [
             os.path.join(BASE_DIR, "templates"),
         ],
@@ -82,15 +87,49 @@ WSGI_APPLICATION = 'brs.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        # Django's PostgreSQL backend with CONN_HEALTH_CHECKS and connection open metrics
+        'ENGINE': 'utility.postgresql',
         'NAME': os.getenv("DB_NAME"),
         'USER': os.getenv("DB_USERNAME"),
         'PASSWORD': os.getenv("DB_PASSWORD"),
         'HOST': os.getenv("DB_HOST"),
-        'PORT': os.getenv("DB_PORT")
+        'PORT': os.getenv("DB_PORT"),
+        # Seconds a worker keeps its connection open between requests (0 closes it after each request).
+        # Keep it 0 with runserver, it opens a thread per request.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 0)),
+        # Check a reused connection with a SELECT 1 before the first query of a request
+        'CONN_HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS', 'true').lower() == 'true',
+        # Behind a transaction pooling PgBouncer, cursors can not outlive their transaction
+        'DISABLE_SERVER_SIDE_CURSORS': os.getenv('DB_EXTERNAL_POOLER', 'false').lower() == 'true',
     }
 }
 
+# Read replicas as comma separated [name@]host[:port], e.g. DB_REPLICAS=replica1,brs@replica2:5433.
+# They share the credentials of the primary unless DB_REPLICA_USERNAME and DB_REPLICA_PASSWORD are set.
+READ_REPLICAS = {
+    'ALIASES': [],
+    # Clients read from the primary for that long after a POST, to see their own writes
+    'STICKY_SECONDS': float(os.getenv('DB_REPLICA_STICKY_SECONDS', 5)),
+    'COOKIE_NAME': 'brs_primary_until',
+}
+for index, replica in enumerate(filter(None, os.getenv('DB_REPLICAS', '').split(','))):
+    name, _, address = replica.strip().rpartition('@')
+    host, _, port = address.partition(':')
+    alias = f'replica{index + 1}'
+    DATABASES[alias] = dict(
+        DATABASES['default'],
+        NAME=name or DATABASES['default']['NAME'],
+        USER=os.getenv('DB_REPLICA_USERNAME', DATABASES['default']['USER']),
+        PASSWORD=os.getenv('DB_REPLICA_PASSWORD', DATABASES['default']['PASSWORD']),
+        HOST=host,
+        PORT=port or DATABASES['default']['PORT'],
+        # Tests run against the primary only
+        TEST={'MIRROR': 'default'},
+    )
+    READ_REPLICAS['ALIASES'].append(alias)
+
+DATABASE_ROUTERS = ['utility.replica.ReplicaRouter']
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -130,21 +169,91 @@ STATICFILES_DIRS = (
     os.path.join(BASE_DIR, "static"),
 )
 STATIC_ROOT = os.getenv('STATIC_ROOT')
+# utility.storage.CompressedManifestStaticFilesStorage fingerprints the collected files and writes
+# .gz/.br copies next to them, {% static %} then links the hashed names (run collectstatic after deploys)
+STATICFILES_STORAGE = os.getenv('STATICFILES_STORAGE', 'django.contrib.staticfiles.storage.StaticFilesStorage')
 
 # Settings Users
 AUTH_USER_MODEL = 'users.User'
 
+# Settings cache, shared by every worker process outside development:
+# CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache with CACHE_LOCATION=<directory>
+# or django.core.cache.backends.memcached.MemcachedCache with CACHE_LOCATION=<host>:<port>
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'brs'),
+        'TIMEOUT': int(os.getenv('CACHE_TIMEOUT', 300)),
+    }
+}
+# Seconds the category list and book detail headers are cached, they are invalidated on every change
+BOOK_CACHE_TIMEOUT = int(os.getenv('BOOK_CACHE_TIMEOUT', 3600))
+
+# Settings pagination of book lists: "page" (numbered pages) or "keyset" (cursor on updated_at, id)
+LIST_PAGINATION = os.getenv('LIST_PAGINATION', 'page')
+# Above this many rows the keyset paginator shows the planner estimate instead of a COUNT(*)
+APPROXIMATE_COUNT_THRESHOLD = int(os.getenv('APPROXIMATE_COUNT_THRESHOLD', 10000))
+
+# Seconds the admin dashboard statistics are cached (refresh_dashboard_stats recomputes them)
+DASHBOARD_CACHE_TIMEOUT = int(os.getenv('DASHBOARD_CACHE_TIMEOUT', 600))
+
 # Settings activity log
 MONGO_LOG = {
     'NAME': os.getenv('MONGO_NAME'),
     'HOST': os.getenv('MONGO_HOST'),
-    'PORT': os.getenv('MONGO_PORT')
+    'PORT': os.getenv('MONGO_PORT'),
+    # The client is created lazily once per (forked) process with these pool limits
+    'MAX_POOL_SIZE': int(os.getenv('MONGO_MAX_POOL_SIZE', 10)),
+    'MIN_POOL_SIZE': int(os.getenv('MONGO_MIN_POOL_SIZE', 0)),
+    'CONNECT_TIMEOUT_MS': int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 2000)),
+    'SOCKET_TIMEOUT_MS': int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', 5000)),
+    'SERVER_SELECTION_TIMEOUT_MS': int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 2000)),
+    'WAIT_QUEUE_TIMEOUT_MS': int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 1000)),
+    # Buffer activity logs and write them in batches from a background thread,
+    # set MONGO_LOG_ASYNC=false to write synchronously inside the request
+    'ASYNC': os.getenv('MONGO_LOG_ASYNC', 'true').lower() == 'true',
+    'BATCH_SIZE': int(os.getenv('MONGO_LOG_BATCH_SIZE', 100)),
+    'FLUSH_INTERVAL': float(os.getenv('MONGO_LOG_FLUSH_INTERVAL', 1.0)),
+    'QUEUE_SIZE': int(os.getenv('MONGO_LOG_QUEUE_SIZE', 10000)),
+    # When the queue is full: "drop" the event at once or "block" up to BLOCK_TIMEOUT seconds
+    'OVERFLOW': os.getenv('MONGO_LOG_OVERFLOW', 'drop'),
+    'BLOCK_TIMEOUT': float(os.getenv('MONGO_LOG_BLOCK_TIMEOUT', 0.05)),
+    # Create the activity indexes on the first read of each process (or run ensure_activity_indexes)
+    'ENSURE_INDEXES': os.getenv('MONGO_LOG_ENSURE_INDEXES', 'true').lower() == 'true',
+    # Seconds the first page of a user's followed timeline is cached, 0 disables it
+    'TIMELINE_CACHE_TIMEOUT': int(os.getenv('MONGO_LOG_TIMELINE_CACHE_TIMEOUT', 300)),
+    # Threads per process fetching activity pages while the views run their SQL queries, 0 fetches inline
+    'READ_THREADS': int(os.getenv('MONGO_LOG_READ_THREADS', 4)),
 }
 
 # Settings media upload file
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Settings user avatars
+AVATAR = {
+    # Larger uploads are rejected by the profile form
+    'MAX_UPLOAD_SIZE': int(os.getenv('AVATAR_MAX_UPLOAD_SIZE', 5 * 1024 * 1024)),
+    # Square JPEG thumbnails (edge in pixels) stored under content hashed names
+    'THUMBNAIL_SIZES': {'small': 64, 'large': 256},
+    'THUMBNAIL_QUALITY': int(os.getenv('AVATAR_THUMBNAIL_QUALITY', 85)),
+    # Generate the thumbnails in a background thread after the upload commits,
+    # set AVATAR_THUMBNAILS_ASYNC=false to generate them inside the request
+    'ASYNC': os.getenv('AVATAR_THUMBNAILS_ASYNC', 'true').lower() == 'true',
+}
+
+# Settings request performance metrics (utility.perf.PerformanceMiddleware)
+PERF = {
+    'ENABLED': os.getenv('PERF_ENABLED', 'true').lower() == 'true',
+    # Send the costs of each response in a Server-Timing header (shown by the browser devtools)
+    'SERVER_TIMING': os.getenv('PERF_SERVER_TIMING', 'true').lower() == 'true',
+    # Every process writes its per view histograms there, read them with the perf_report command
+    'SINK_DIR': os.getenv('PERF_SINK_DIR', os.path.join(tempfile.gettempdir(), 'brs-perf')),
+    'FLUSH_INTERVAL': float(os.getenv('PERF_FLUSH_INTERVAL', 10)),
+    # Log the requests running the same query shape at least that many times (0 disables, slow: staging only)
+    'N_PLUS_ONE_THRESHOLD': int(os.getenv('PERF_N_PLUS_ONE_THRESHOLD', 0)),
+}
+
 # Settings logging
 LOGGING = {
     'version': 1,
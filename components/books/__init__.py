@@ -0,0 +1 @@
+default_app_config = 'components.books.apps.BooksConfig'
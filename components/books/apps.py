@@ -2,4 +2,8 @@ from django.apps import AppConfig
 
 
 class BooksConfig(AppConfig):
-    name = 'books'
+    name = 'components.books'
+    label = 'books'
+
+    def ready(self):
+        from . import signals  # noqa: F401
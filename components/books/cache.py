@@ -0,0 +1,74 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from utility.replica import use_primary
+from .models import Book, BookCategory
+
+CATEGORIES_CACHE_KEY = 'books:categories:{}'
+CATEGORIES_GENERATION_KEY = 'books:categories:generation'
+BOOK_CACHE_KEY = 'books:book:{}:{}'
+BOOK_GENERATION_KEY = 'books:book:{}:generation'
+BOOK_LIST_VERSION_KEY = 'books:list:version'
+
+
+def book_generation_key(book_id):
+    return BOOK_GENERATION_KEY.format(book_id)
+
+
+def book_cache_key(book_id, generation):
+    return BOOK_CACHE_KEY.format(book_id, generation)
+
+
+def get_categories():
+    """Categories ordered by name, each annotated with num_book."""
+    key = CATEGORIES_CACHE_KEY.format(cache.get_or_set(CATEGORIES_GENERATION_KEY, time.time_ns, None))
+    categories = cache.get(key)
+    if categories is None:
+        # Cached entries outlive the replication lag, they are filled from the primary
+        with use_primary():
+            categories = list(BookCategory.objects.annotate(num_book=Count('book')).order_by('name'))
+        cache.set(key, categories, settings.BOOK_CACHE_TIMEOUT)
+    return categories
+
+
+def get_book(book_id):
+    """Book with its categories prefetched for the detail header, None when it does not exist."""
+    # Started now when unknown so an evicted generation never repeats
+    generation = cache.get_or_set(book_generation_key(book_id), time.time_ns, None)
+    key = book_cache_key(book_id, generation)
+    book = cache.get(key)
+    if book is None:
+        with use_primary():
+            book = Book.objects.defer('search_vector').prefetch_related('book_category').filter(pk=book_id).first()
+        if book is None:
+            return None
+        cache.set(key, book, settings.BOOK_CACHE_TIMEOUT)
+    return book
+
+
+def get_book_list_version():
+    """Time of the last committed change of any book, read status or category (validator of the book list)."""
+    return cache.get_or_set(BOOK_LIST_VERSION_KEY, timezone.now, None)
+
+
+def touch_book_list_version():
+    transaction.on_commit(lambda: cache.set(BOOK_LIST_VERSION_KEY, timezone.now(), None))
+
+
+def invalidate_categories():
+    transaction.on_commit(lambda: cache.set(CATEGORIES_GENERATION_KEY, time.time_ns(), None))
+    touch_book_list_version()
+
+
+def invalidate_books(book_ids):
+    # Moving the generations after commit leaves the cached rows unreachable (categories too). A request
+    # that read the old row before the commit still caches it, but under a generation nobody reads any more.
+    keys = [book_generation_key(book_id) for book_id in book_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.set_many(dict.fromkeys(keys, time.time_ns()), None))
+        touch_book_list_version()
@@ -0,0 +1,237 @@
+import csv
+import json
+
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db import connections, transaction
+from django.db.models import Q
+from django.db.models.functions import Lower, Trim
+from django.utils import timezone
+
+from .cache import invalidate_books, invalidate_categories
+from .forms import BookImportForm
+from .models import Book, BookCategory
+
+FORMATS = ('csv', 'jsonl')
+FIELDS = ('name', 'author', 'description', 'image', 'categories', 'paperback', 'language', 'publisher', 'price')
+BOOK_FIELDS = [field for field in FIELDS if field != 'categories']
+# Categories of a CSV row are joined in a single column
+CATEGORY_SEPARATOR = '|'
+LANGUAGE_LABELS = dict(Book.LANGUAGE_CHOICES)
+LANGUAGES = {label.lower(): value for value, label in Book.LANGUAGE_CHOICES}
+
+
+def detect_format(path, file_format=None):
+    if file_format:
+        return file_format
+    extension = path.rsplit('.', 1)[-1].lower()
+    if extension in ('jsonl', 'ndjson'):
+        return 'jsonl'
+    if extension == 'csv':
+        return 'csv'
+    raise ValueError(f'Can not tell the format of {path}, choose one of {", ".join(FORMATS)}')
+
+
+def natural_key(name, author):
+    """Books are the same when their name and author only differ by case and surrounding spaces."""
+    return (name or '').strip().casefold(), (author or '').strip().casefold()
+
+
+def read_rows(stream, file_format):
+    """Yield the (line number, row dict) of a catalogue file one at a time, unparsable lines as (line, None)."""
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+class RowWriter(object):
+    """Write catalogue rows (with extra columns, e.g. the rejection reason) as CSV or JSONL."""
+
+    def __init__(self, stream, file_format, fields=FIELDS):
+        self.stream = stream
+        self.file_format = file_format
+        self.fields = list(fields)
+        if file_format == 'csv':
+            self.writer = csv.DictWriter(stream, self.fields, extrasaction='ignore')
+            self.writer.writeheader()
+
+    def write(self, row):
+        if self.file_format == 'csv':
+            categories = row.get('categories')
+            if isinstance(categories, list):
+                row = dict(row, categories=CATEGORY_SEPARATOR.join(categories))
+            self.writer.writerow(row)
+        else:
+            self.stream.write(json.dumps({field: row.get(field) for field in self.fields}, ensure_ascii=False))
+            self.stream.write('\n')
+
+
+def export_rows(books, chunk_size):
+    """Yield the catalogue row of each book, streamed from a server side cursor chunk_size rows at a time."""
+    rows = books.order_by('pk').annotate(categories=ArrayAgg(
+        'book_category__name', filter=Q(book_category__isnull=False), ordering='book_category__name',
+    )).values('pk', *FIELDS)
+    if connections[rows.db].settings_dict.get('DISABLE_SERVER_SIDE_CURSORS'):
+        # iterator() would fetch every row at once, read pages by primary key instead
+        rows = _keyset_pages(rows, chunk_size)
+    else:
+        rows = rows.iterator(chunk_size=chunk_size)
+    for row in rows:
+        row['language'] = LANGUAGE_LABELS.get(row['language'], row['language'])
+        yield row
+
+
+def _keyset_pages(rows, chunk_size):
+    last_pk = 0
+    while True:
+        page = list(rows.filter(pk__gt=last_pk)[:chunk_size])
+        yield from page
+        if len(page) < chunk_size:
+            return
+        last_pk = page[-1]['pk']
+
+
+class BookImporter(object):
+    """Create or update books from catalogue rows, one transaction and a handful of queries per batch.
+
+    Rows are deduplicated by natural_key: a row matching an existing book updates it (unless
+    update_existing is off) and the last of several rows with the same key wins.
+    """
+
+    def __init__(self, update_existing=True, dry_run=False):
+        self.update_existing = update_existing
+        self.dry_run = dry_run
+        self.counts = {'created': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0, 'rejected': 0}
+        self.categories_created = 0
+
+    def clean(self, row):
+        """Return (book fields, category names) of a row or raise ValueError with the reason it is rejected."""
+        if row is None:
+            raise ValueError('not a JSON object')
+        data = {field: row.get(field) for field in BOOK_FIELDS}
+        data = {field: '' if value is None else value for field, value in data.items()}
+        language = str(data['language']).strip()
+        data['language'] = LANGUAGES.get(language.lower(), language or Book.LANGUAGE_CHOICES[0][0])
+        for field, default in (('paperback', 1), ('price', 0)):
+            if data[field] == '':
+                data[field] = default
+        form = BookImportForm(data)
+        if not form.is_valid():
+            raise ValueError('; '.join(f'{field}: {" ".join(errors)}' for field, errors in form.errors.items()))
+
+        categories = row.get('categories') or []
+        if isinstance(categories, str):
+            categories = categories.split(CATEGORY_SEPARATOR)
+        if not isinstance(categories, list):
+            raise ValueError('categories: expected a list of names')
+        names = list(dict.fromkeys(str(name).strip() for name in categories if str(name).strip()))
+        max_length = BookCategory._meta.get_field('name').max_length
+        too_long = [name for name in names if len(name) > max_length]
+        if too_long:
+            raise ValueError(f'categories: names longer than {max_length} characters: {", ".join(too_long)}')
+        return form.cleaned_data, names
+
+    def import_batch(self, rows, on_reject):
+        """Import a list of (line number, row), on_reject(line number, row, reason) is called for invalid rows."""
+        cleaned = {}
+        for line_number, row in rows:
+            try:
+                fields, categories = self.clean(row)
+            except ValueError as error:
+                self.counts['rejected'] += 1
+                on_reject(line_number, row, str(error))
+                continue
+            key = natural_key(fields['name'], fields['author'])
+            if key in cleaned:
+                self.counts['skipped'] += 1
+            cleaned[key] = (fields, categories)
+        if not cleaned:
+            return
+
+        with transaction.atomic():
+            self.save(cleaned)
+            if self.dry_run:
+                transaction.set_rollback(True)
+
+    def save(self, cleaned):
+        existing = {}
+        matches = Book.objects.annotate(key_name=Lower(Trim('name'))).filter(key_name__in={name for name, _ in cleaned})
+        for book in matches.defer('search_vector').order_by('pk'):
+            existing.setdefault(natural_key(book.name, book.author), book)
+        through = Book.book_category.through
+        current_categories = {}
+        for book_id, name in through.objects.filter(book__in=existing.values()).values_list(
+                'book_id', 'bookcategory__name'):
+            current_categories.setdefault(book_id, set()).add(name)
+
+        now = timezone.now()
+        created, updated, recategorized = [], [], []
+        for key, (fields, names) in cleaned.items():
+            book = existing.get(key)
+            if book is None:
+                created.append(Book(**fields))
+                continue
+            if not self.update_existing:
+                self.counts['skipped'] += 1
+                continue
+            # Rows repeating what is stored are left alone, bulk_update costs a CASE per row and field
+            changed = any(getattr(book, field) != value for field, value in fields.items())
+            if changed:
+                for field, value in fields.items():
+                    setattr(book, field, value)
+                # bulk_update does not touch auto_now fields
+                book.updated_at = now
+                updated.append(book)
+            if set(names) != current_categories.get(book.pk, set()):
+                recategorized.append(book)
+            elif not changed:
+                self.counts['unchanged'] += 1
+        Book.objects.bulk_create(created)
+        Book.objects.bulk_update(updated, BOOK_FIELDS + ['updated_at'])
+        updated_ids = {book.pk for book in updated}
+        Book.objects.filter(pk__in=[book.pk for book in recategorized if book.pk not in updated_ids]).update(
+            updated_at=now)
+
+        books = {natural_key(book.name, book.author): book for book in created + updated + recategorized}
+        self.counts['created'] += len(created)
+        self.counts['updated'] += len(books) - len(created)
+        if not books:
+            return
+        categorized = {natural_key(book.name, book.author): book for book in created + recategorized}
+        category_ids = self.resolve_categories({
+            name for key, (_, names) in cleaned.items() if key in categorized for name in names
+        })
+        # The categories of a row replace the ones of the book it updates
+        through.objects.filter(book__in=recategorized).delete()
+        through.objects.bulk_create([
+            through(book_id=categorized[key].pk, bookcategory_id=category_ids[name])
+            for key, (_, names) in cleaned.items() if key in categorized
+            for name in names
+        ])
+
+        book_ids = [book.pk for book in books.values()]
+        Book.objects.filter(pk__in=book_ids).update_search_vector()
+        invalidate_books(book_ids)
+        if categorized:
+            invalidate_categories()
+
+    def resolve_categories(self, names):
+        """Return {name: category id}, creating the missing categories."""
+        category_ids = {}
+        for category_id, name in BookCategory.objects.filter(name__in=names).order_by('-pk').values_list('pk', 'name'):
+            # Names are not unique, the oldest category of a name is used
+            category_ids[name] = category_id
+        missing = [BookCategory(name=name) for name in sorted(names - set(category_ids))]
+        for category in BookCategory.objects.bulk_create(missing):
+            category_ids[category.name] = category.pk
+        self.categories_created += len(missing)
+        return category_ids
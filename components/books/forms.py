@@ -32,6 +32,21 @@ class BookUpdateForm(forms.ModelForm):
                   'price']
 
 
+class BookImportForm(forms.ModelForm):
+    """Book fields of one catalogue file row, its categories are given by name and resolved by the importer."""
+
+    class Meta:
+        model = Book
+        fields = ['name',
+                  'description',
+                  'image',
+                  'author',
+                  'paperback',
+                  'language',
+                  'publisher',
+                  'price']
+
+
 class BookMarkReadForm(forms.Form):
     page_reading = forms.IntegerField(min_value=1)
 
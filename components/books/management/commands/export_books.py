@@ -0,0 +1,42 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from components.books.catalogue import FORMATS, RowWriter, detect_format, export_rows
+from components.books.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Write the book catalogue as CSV or JSONL, streamed so memory stays flat for any catalogue size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Output file, - for stdout')
+        parser.add_argument('--format', choices=FORMATS, help='Taken from the file extension by default')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows fetched from the database at a time')
+        parser.add_argument('--include-inactive', action='store_true')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            file_format = detect_format(path, options['format'] or ('csv' if path == '-' else None))
+        except ValueError as error:
+            raise CommandError(error)
+
+        books = Book.objects.all()
+        if not options['include_inactive']:
+            books = books.filter(is_activate=True)
+
+        output = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        total = 0
+        try:
+            writer = RowWriter(output, file_format)
+            for row in export_rows(books, options['batch_size']):
+                writer.write(row)
+                total += 1
+                if path != '-' and total % options['batch_size'] == 0:
+                    self.stdout.write(f'Exported {total} books')
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        if path != '-':
+            self.stdout.write(self.style.SUCCESS(f'{total} books exported to {path}'))
@@ -0,0 +1,74 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from components.books.catalogue import FIELDS, FORMATS, BookImporter, RowWriter, detect_format, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Create or update books from a CSV or JSONL catalogue file, streamed and saved in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help=f'Catalogue file, - for stdin. Columns: {", ".join(FIELDS)} '
+                                         f'(CSV categories are separated by |)')
+        parser.add_argument('--format', choices=FORMATS, help='Taken from the file extension by default')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows saved per transaction')
+        parser.add_argument('--skip-existing', action='store_true',
+                            help='Leave the books already in the catalogue (same name and author) untouched')
+        parser.add_argument('--rejects', help='File to write the rejected rows to, with the reason of each')
+        parser.add_argument('--dry-run', action='store_true', help='Validate and report without saving anything')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            file_format = detect_format(path, options['format'] or ('csv' if path == '-' else None))
+        except ValueError as error:
+            raise CommandError(error)
+
+        importer = BookImporter(update_existing=not options['skip_existing'], dry_run=options['dry_run'])
+        rejects_file = open(options['rejects'], 'w', newline='') if options['rejects'] else None
+        rejects = RowWriter(rejects_file, file_format, FIELDS + ('line', 'error')) if rejects_file else None
+
+        def on_reject(line_number, row, reason):
+            if rejects:
+                rejects.write(dict(row or {}, line=line_number, error=reason))
+            if importer.counts['rejected'] <= 10:
+                self.stderr.write(f'Line {line_number} rejected: {reason}')
+
+        start = time.monotonic()
+        batch_size = options['batch_size']
+        total = 0
+        source = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8-sig')
+        try:
+            batch = []
+            for row in read_rows(source, file_format):
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    importer.import_batch(batch, on_reject)
+                    total += len(batch)
+                    batch = []
+                    self.stdout.write(self.progress(total, importer, start))
+            if batch:
+                importer.import_batch(batch, on_reject)
+                total += len(batch)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if rejects_file:
+                rejects_file.close()
+
+        self.stdout.write(self.progress(total, importer, start))
+        if importer.counts['rejected'] and rejects:
+            self.stdout.write(f"Rejected rows written to {options['rejects']}")
+        message = f'{importer.categories_created} categories created'
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'Dry run, nothing was saved ({message})'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Catalogue imported, {message}'))
+
+    def progress(self, total, importer, start):
+        counts = importer.counts
+        return (f"{total} rows read: {counts['created']} created, {counts['updated']} updated, "
+                f"{counts['unchanged']} unchanged, {counts['skipped']} skipped, {counts['rejected']} rejected "
+                f'({total / max(time.monotonic() - start, 0.001):.0f} rows/s)')
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from components.books.cache import invalidate_books
+from components.books.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Recompute the rating and read status counters stored on books in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        total = 0
+        while True:
+            book_ids = list(Book.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)
+                            [:batch_size])
+            if not book_ids:
+                break
+            with transaction.atomic():
+                total += Book.objects.filter(pk__in=book_ids).rebuild_read_status_stats()
+                invalidate_books(book_ids)
+            last_id = book_ids[-1]
+            self.stdout.write(f'Rebuilt {total} books (last id {last_id})')
+
+        self.stdout.write(self.style.SUCCESS(f'Read status counters rebuilt for {total} books'))
@@ -0,0 +1,241 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from components.books.cache import invalidate_categories
+from components.books.models import Book, BookCategory, BookComment, BookReadStatus
+from components.users.models import User, UserFollow
+from utility.log_activity import ActivityLog
+from utility.mongo import get_mongo_db
+
+# Seeded rows are recognised by these markers, --clear only deletes them
+EMAIL_DOMAIN = 'seed.brs'
+PUBLISHER = 'BRS Seed'
+CATEGORY_PREFIX = 'Seed '
+# Seeded times count back from this instant, never from now, so a seed always gives the same rows
+EPOCH = datetime(2020, 4, 1, tzinfo=timezone.utc)
+
+ADJECTIVES = ('Silent', 'Hidden', 'Broken', 'Golden', 'Last', 'Lost', 'Crimson', 'Distant', 'Quiet', 'Wild',
+              'Little', 'Ancient', 'Burning', 'Secret', 'Endless', 'Frozen')
+NOUNS = ('Garden', 'River', 'Empire', 'Letter', 'Kingdom', 'Station', 'Winter', 'Ocean', 'Machine', 'Forest',
+         'Promise', 'Island', 'Algorithm', 'Bridge', 'Harvest', 'Mountain')
+WORDS = ('story', 'life', 'history', 'journey', 'family', 'war', 'science', 'city', 'love', 'time', 'world',
+         'python', 'data', 'design', 'music', 'night', 'road', 'home', 'memory', 'light')
+CATEGORIES = ('Fiction', 'History', 'Science', 'Technology', 'Business', 'Poetry', 'Travel', 'Biography',
+              'Children', 'Comics', 'Cooking', 'Art', 'Philosophy', 'Religion', 'Health', 'Sports')
+
+
+class Command(BaseCommand):
+    help = 'Seed deterministic synthetic books, users, read statuses, follows, reviews and activity for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=100000)
+        parser.add_argument('--users', type=int, default=50000)
+        parser.add_argument('--categories', type=int, default=48)
+        parser.add_argument('--statuses-per-user', type=int, default=40,
+                            help='Read statuses of each user, 40 for 50k users is 2M BookReadStatus rows')
+        parser.add_argument('--follows-per-user', type=int, default=20)
+        parser.add_argument('--reviews-per-book', type=float, default=2)
+        parser.add_argument('--activities-per-user', type=int, default=20,
+                            help='Mongo activity documents of each user, 0 to leave Mongo alone')
+        parser.add_argument('--password', default='benchmark', help='Password of every seeded user')
+        parser.add_argument('--seed', type=int, default=2020, help='Same seed and scale, same data')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--clear', action='store_true', help='Delete the previously seeded rows first')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        start = time.monotonic()
+
+        if options['clear']:
+            self.clear(options['activities_per_user'])
+        elif User.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}').exists():
+            self.stderr.write('Seeded data already exists, run again with --clear to replace it')
+            return
+
+        category_ids = self.seed_categories(options['categories'])
+        book_ids = self.seed_books(options['books'], category_ids)
+        user_ids = self.seed_users(options['users'], options['password'])
+        self.seed_read_statuses(user_ids, book_ids, options['statuses_per_user'])
+        self.seed_follows(user_ids, options['follows_per_user'])
+        self.seed_reviews(user_ids, book_ids, options['reviews_per_book'])
+        if options['activities_per_user']:
+            self.seed_activities(user_ids, book_ids, options['activities_per_user'])
+
+        # Stored aggregates and search documents are derived from the rows above
+        for command in ('update_search_vector', 'rebuild_book_stats', 'rebuild_follow_counts'):
+            call_command(command, batch_size=self.batch_size, stdout=self.stdout)
+        call_command('refresh_dashboard_stats', stdout=self.stdout)
+        invalidate_categories()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {len(book_ids)} books, {len(user_ids)} users in {time.monotonic() - start:.0f}s, '
+            f'sign in as admin@{EMAIL_DOMAIN} or user0@{EMAIL_DOMAIN} with password {options["password"]}'
+        ))
+
+    def clear(self, activities):
+        users = User.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}')
+        if activities:
+            user_ids = list(users.values_list('pk', flat=True))
+            get_mongo_db()['activity'].delete_many({'source_user_id': {'$in': user_ids}})
+        with transaction.atomic():
+            # Deleting the users cascades to their statuses, follows and reviews
+            users.delete()
+            Book.objects.filter(publisher=PUBLISHER).delete()
+            BookCategory.objects.filter(name__startswith=CATEGORY_PREFIX).delete()
+        self.stdout.write('Cleared the previously seeded data')
+
+    def bulk_create(self, model, rows):
+        """Insert rows (any iterable) batch by batch and return the ids in order."""
+        ids = []
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                ids += self.insert(model, batch)
+                batch = []
+        ids += self.insert(model, batch)
+        return ids
+
+    def insert(self, model, batch):
+        if not batch:
+            return []
+        with transaction.atomic():
+            objects = model.objects.bulk_create(batch)
+        self.stdout.write(f'Inserted {len(batch)} {model._meta.db_table} rows')
+        return [obj.pk for obj in objects]
+
+    def seed_categories(self, count):
+        return self.bulk_create(BookCategory, (
+            BookCategory(name=f'{CATEGORY_PREFIX}{CATEGORIES[index % len(CATEGORIES)]} {index // len(CATEGORIES) + 1}')
+            for index in range(count)
+        ))
+
+    def sentence(self, length):
+        return ' '.join(self.rng.choice(WORDS) for _ in range(length)).capitalize() + '.'
+
+    def seed_books(self, count, category_ids):
+        rng = self.rng
+        book_ids = self.bulk_create(Book, (
+            Book(
+                name=f'The {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {index + 1}',
+                description=' '.join(self.sentence(rng.randint(6, 14)) for _ in range(rng.randint(2, 6))),
+                author=f'{rng.choice(NOUNS)} {rng.choice(ADJECTIVES)}',
+                paperback=rng.randint(80, 900),
+                language=rng.choice(Book.LANGUAGE_CHOICES)[0],
+                publisher=PUBLISHER,
+                price=rng.randint(5, 300) * 1000,
+            )
+            for index in range(count)
+        ))
+        through = Book.book_category.through
+        self.bulk_create(through, (
+            through(book_id=book_id, bookcategory_id=category_id)
+            for book_id in book_ids
+            for category_id in rng.sample(category_ids, min(rng.randint(1, 3), len(category_ids)))
+        ))
+        return book_ids
+
+    def seed_users(self, count, password):
+        # Hashing is slow by design, every user shares the same hash
+        password = make_password(password)
+        user_ids = self.bulk_create(User, [User(
+            username='admin', email=f'admin@{EMAIL_DOMAIN}', password=password, role=User.ROLE_ADMIN,
+            is_activate=True,
+        )])
+        user_ids += self.bulk_create(User, (
+            User(
+                username=f'user{index}',
+                email=f'user{index}@{EMAIL_DOMAIN}',
+                password=password,
+                is_activate=True,
+                location=self.rng.choice(NOUNS),
+                last_login=EPOCH - timedelta(minutes=self.rng.randint(0, 60 * 24 * 90)),
+            )
+            for index in range(count)
+        ))
+        return user_ids
+
+    def popular(self, ids, count):
+        """Sample distinct ids, the first ones more often (a few books and users attract most readers)."""
+        count = min(count, len(ids))
+        picked = set()
+        while len(picked) < count:
+            picked.add(ids[min(int(self.rng.paretovariate(1.2)) - 1, len(ids) - 1)]
+                       if self.rng.random() < 0.3 else self.rng.choice(ids))
+        return sorted(picked)
+
+    def seed_read_statuses(self, user_ids, book_ids, per_user):
+        rng = self.rng
+        statuses = [value for value, _ in BookReadStatus.STATUS_CHOICES]
+
+        def rows():
+            for user_id in user_ids:
+                for book_id in self.popular(book_ids, per_user):
+                    status = rng.choice(statuses)
+                    yield BookReadStatus(
+                        user_id=user_id,
+                        book_id=book_id,
+                        status=status,
+                        page_reading=rng.randint(1, 300) if status else 0,
+                        is_favorite=rng.random() < 0.2,
+                        rating=rng.randint(1, 5) if status == BookReadStatus.STATUS_CHOICES[2][0] else 0,
+                    )
+        self.bulk_create(BookReadStatus, rows())
+
+    def seed_follows(self, user_ids, per_user):
+        follow = UserFollow.STATUS_FOLLOW[1][0]
+        self.bulk_create(UserFollow, (
+            UserFollow(follower_id=user_id, following_id=following_id, status=follow)
+            for user_id in user_ids
+            for following_id in self.popular(user_ids, per_user + 1) if following_id != user_id
+        ))
+
+    def seed_reviews(self, user_ids, book_ids, per_book):
+        rng = self.rng
+        self.bulk_create(BookComment, (
+            BookComment(book_id=self.popular(book_ids, 1)[0], user_id=rng.choice(user_ids),
+                        body=self.sentence(rng.randint(4, 30))[:512])
+            for _ in range(int(len(book_ids) * per_book))
+        ))
+
+    def seed_activities(self, user_ids, book_ids, per_user):
+        rng = self.rng
+        usernames = dict(User.objects.filter(pk__in=user_ids).values_list('pk', 'username'))
+        book_names = dict(Book.objects.filter(pk__in=book_ids).values_list('pk', 'name'))
+        collection = get_mongo_db()['activity']
+        start = datetime(2020, 1, 1)
+        activities = (ActivityLog.READING, ActivityLog.READ, ActivityLog.FAVORITE_MSG, ActivityLog.COMMENT)
+        batch = []
+        total = 0
+        for user_id in user_ids:
+            for _ in range(per_user):
+                book_id = rng.choice(book_ids)
+                activity = rng.choice(activities)
+                data = {
+                    'source_user': usernames[user_id],
+                    'source_user_id': user_id,
+                    'activity': activity,
+                    'create_at': start + timedelta(seconds=rng.randint(0, 3600 * 24 * 365)),
+                    'obj_target_name': book_names[book_id],
+                    'obj_target_id': book_id,
+                    'obj_target': 'book',
+                }
+                if activity == ActivityLog.COMMENT:
+                    data.update({'obj_target': 'comment', 'obj_target_content': self.sentence(rng.randint(4, 30))})
+                batch.append(data)
+            if len(batch) >= self.batch_size:
+                collection.insert_many(batch, ordered=False)
+                total += len(batch)
+                batch = []
+        if batch:
+            collection.insert_many(batch, ordered=False)
+            total += len(batch)
+        self.stdout.write(f'Inserted {total} activity documents')
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from components.books.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Backfill the stored full text search vector of books in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--only-missing', action='store_true',
+                            help='Only update books without a search vector')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        books_qs = Book.objects.order_by('pk')
+        if options['only_missing']:
+            books_qs = books_qs.filter(search_vector__isnull=True)
+
+        last_id = 0
+        total = 0
+        while True:
+            book_ids = list(books_qs.filter(pk__gt=last_id).values_list('pk', flat=True)[:batch_size])
+            if not book_ids:
+                break
+            with transaction.atomic():
+                total += Book.objects.filter(pk__in=book_ids).update_search_vector()
+            last_id = book_ids[-1]
+            self.stdout.write(f'Updated {total} books (last id {last_id})')
+
+        self.stdout.write(self.style.SUCCESS(f'Search vector updated for {total} books'))
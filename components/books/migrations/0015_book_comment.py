@@ -0,0 +1,35 @@
+# Generated by Django 3.0.5 on 2026-10-18 17:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('books', '0014_book_read_status_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookComment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('is_activate', models.BooleanField(default=True)),
+                ('body', models.CharField(max_length=512)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='comments', to='books.Book')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='book_comments', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'book_comment',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='bookcomment',
+            index=models.Index(fields=['book', '-created_at'], name='book_commen_book_id_21a7d9_idx'),
+        ),
+    ]
@@ -0,0 +1,76 @@
+import logging
+from datetime import datetime
+
+from django.db import migrations, transaction
+from django.utils import timezone
+
+log = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+DATE_FORMAT = '%m/%d/%Y, %H:%M:%S'
+
+
+def copy_review_messages(apps, schema_editor):
+    BookReview = apps.get_model('books', 'BookReview')
+    BookComment = apps.get_model('books', 'BookComment')
+    User = apps.get_model('users', 'User')
+    # Keep the original posting time of the messages
+    BookComment._meta.get_field('created_at').auto_now_add = False
+    BookComment._meta.get_field('updated_at').auto_now = False
+
+    user_ids = set(User.objects.values_list('id', flat=True))
+    # The books of each batch are copied in one transaction, a run stopped halfway is resumed
+    # by running the migration again: books which already have comments are skipped
+    copied_book_ids = set(BookComment.objects.values_list('book_id', flat=True).distinct())
+    comments = []
+    skipped = 0
+    for review in BookReview.objects.order_by('pk').iterator(chunk_size=100):
+        if review.book_id in copied_book_ids:
+            continue
+        for message in review.messages:
+            # message: [username, body, created at, user id, avatar]
+            if len(message) < 4 or not message[3].isdigit() or int(message[3]) not in user_ids:
+                skipped += 1
+                continue
+            try:
+                created_at = timezone.make_aware(datetime.strptime(message[2], DATE_FORMAT), timezone.utc)
+            except ValueError:
+                created_at = review.updated_at
+            comments.append(BookComment(book_id=review.book_id, user_id=int(message[3]), body=message[1],
+                                        created_at=created_at, updated_at=created_at))
+        if len(comments) >= BATCH_SIZE:
+            with transaction.atomic():
+                BookComment.objects.bulk_create(comments)
+            comments = []
+    if comments:
+        with transaction.atomic():
+            BookComment.objects.bulk_create(comments)
+    if skipped:
+        log.warning('Skipped %s review messages without an existing user', skipped)
+
+
+def restore_review_messages(apps, schema_editor):
+    BookReview = apps.get_model('books', 'BookReview')
+    BookComment = apps.get_model('books', 'BookComment')
+
+    book_ids = BookComment.objects.order_by('book_id').values_list('book_id', flat=True).distinct()
+    for book_id in book_ids.iterator():
+        messages = [
+            [comment.user.username, comment.body, comment.created_at.strftime(DATE_FORMAT),
+             str(comment.user_id), str(comment.user.avatar.name or '')]
+            for comment in BookComment.objects.filter(book_id=book_id).select_related('user').order_by('created_at',
+                                                                                                       'id')
+        ]
+        BookReview.objects.update_or_create(book_id=book_id, defaults={'messages': messages})
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('books', '0015_book_comment'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_review_messages, restore_review_messages),
+    ]
@@ -0,0 +1,14 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0016_copy_book_review_messages'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='BookReview',
+        ),
+    ]
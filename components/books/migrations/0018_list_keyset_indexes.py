@@ -0,0 +1,21 @@
+# Generated by Django 3.0.5 on 2026-10-18 17:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0017_delete_bookreview'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['is_activate', 'updated_at', 'id'], name='book_is_acti_e01419_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookrequestbuy',
+            index=models.Index(fields=['is_activate', 'updated_at', 'id'], name='book_reques_is_acti_16fc06_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('books', '0018_list_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='bookreadstatus',
+            old_name='user',
+            new_name='readers',
+        ),
+        migrations.AddField(
+            model_name='bookreadstatus',
+            name='user',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE,
+                                    related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
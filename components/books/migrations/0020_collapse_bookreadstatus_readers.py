@@ -0,0 +1,111 @@
+from django.db import migrations, transaction
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 1000
+COPIED_FIELDS = ('created_at', 'updated_at', 'is_activate', 'book_id', 'status', 'page_reading', 'is_favorite',
+                 'rating')
+READING, READ = 1, 2
+
+
+def rebuild_read_status_stats(apps, book_ids):
+    """Recompute the counters stored on these books, as BookQuerySet.rebuild_read_status_stats does."""
+    Book = apps.get_model('books', 'Book')
+    BookReadStatus = apps.get_model('books', 'BookReadStatus')
+
+    def aggregate(expression, **filters):
+        statuses = BookReadStatus.objects.filter(book=OuterRef('pk'), **filters).order_by().values('book')
+        return Coalesce(Subquery(statuses.annotate(value=expression).values('value')), Value(0))
+
+    book_ids = sorted(book_ids)
+    for start in range(0, len(book_ids), BATCH_SIZE):
+        Book.objects.filter(pk__in=book_ids[start:start + BATCH_SIZE]).update(
+            rating_sum=aggregate(Sum('rating'), rating__gt=0),
+            rating_count=aggregate(Count('pk'), rating__gt=0),
+            reader_count=aggregate(Count('pk'), status__in=(READING, READ)),
+            reading_count=aggregate(Count('pk'), status=READING),
+            read_count=aggregate(Count('pk'), status=READ),
+            favorite_count=aggregate(Count('pk'), is_favorite=True),
+        )
+
+
+def collapse_readers(apps, schema_editor):
+    BookReadStatus = apps.get_model('books', 'BookReadStatus')
+    Readers = BookReadStatus.readers.through
+    BookReadStatus._meta.get_field('created_at').auto_now_add = False
+    BookReadStatus._meta.get_field('updated_at').auto_now = False
+
+    # The counters stored on books count status rows, they change for every book collapsed below
+    changed_book_ids = set()
+
+    # One row per (status, reader): the first reader takes the row, the others get a copy
+    last_id = 0
+    while True:
+        statuses = list(BookReadStatus.objects.filter(pk__gt=last_id).order_by('pk')[:BATCH_SIZE])
+        if not statuses:
+            break
+        last_id = statuses[-1].pk
+        readers = {}
+        for status_id, user_id in Readers.objects.filter(bookreadstatus_id__in=[status.pk for status in statuses]
+                                                         ).order_by('user_id').values_list('bookreadstatus_id',
+                                                                                           'user_id'):
+            readers.setdefault(status_id, []).append(user_id)
+
+        updated, created = [], []
+        for status in statuses:
+            user_ids = readers.get(status.pk)
+            if not user_ids:
+                continue
+            status.user_id = user_ids[0]
+            updated.append(status)
+            if len(user_ids) > 1:
+                changed_book_ids.add(status.book_id)
+            created.extend(BookReadStatus(user_id=user_id, **{name: getattr(status, name) for name in COPIED_FIELDS})
+                           for user_id in user_ids[1:])
+        with transaction.atomic():
+            BookReadStatus.objects.bulk_update(updated, ['user'])
+            BookReadStatus.objects.bulk_create(created)
+
+    orphans = BookReadStatus.objects.filter(user__isnull=True)
+    changed_book_ids.update(orphans.values_list('book_id', flat=True).distinct())
+    orphans.delete()
+
+    # Keep the most recent status of each (user, book), with the last rating given if it has none
+    duplicates = BookReadStatus.objects.values('user_id', 'book_id').annotate(total=Count('id')).filter(total__gt=1)
+    for duplicate in duplicates.iterator():
+        with transaction.atomic():
+            rows = list(BookReadStatus.objects.filter(user_id=duplicate['user_id'], book_id=duplicate['book_id'])
+                        .order_by('-updated_at', '-id'))
+            kept = rows[0]
+            if not kept.rating:
+                kept.rating = next((row.rating for row in rows if row.rating), 0)
+                kept.save(update_fields=['rating'])
+            BookReadStatus.objects.filter(pk__in=[row.pk for row in rows[1:]]).delete()
+        changed_book_ids.add(duplicate['book_id'])
+
+    rebuild_read_status_stats(apps, changed_book_ids)
+
+
+def restore_readers(apps, schema_editor):
+    BookReadStatus = apps.get_model('books', 'BookReadStatus')
+    Readers = BookReadStatus.readers.through
+    statuses = BookReadStatus.objects.filter(user__isnull=False).values_list('id', 'user_id')
+    readers = []
+    for status_id, user_id in statuses.iterator():
+        readers.append(Readers(bookreadstatus_id=status_id, user_id=user_id))
+        if len(readers) >= BATCH_SIZE:
+            Readers.objects.bulk_create(readers)
+            readers = []
+    Readers.objects.bulk_create(readers)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('books', '0019_bookreadstatus_user_fk'),
+    ]
+
+    operations = [
+        migrations.RunPython(collapse_readers, restore_readers),
+    ]
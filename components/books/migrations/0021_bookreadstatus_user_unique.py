@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('books', '0020_collapse_bookreadstatus_readers'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='bookreadstatus',
+            name='readers',
+        ),
+        migrations.AlterField(
+            model_name='bookreadstatus',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='bookreadstatus',
+            index=models.Index(fields=['user', 'status', 'book'], name='book_read_s_user_id_8b9f1f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookreadstatus',
+            index=models.Index(fields=['user', 'is_favorite', 'book'], name='book_read_s_user_id_7885c4_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='bookreadstatus',
+            constraint=models.UniqueConstraint(fields=('user', 'book'), name='book_read_status_user_book_unique'),
+        ),
+    ]
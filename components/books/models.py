@@ -1,6 +1,10 @@
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
-from django.contrib.postgres.fields import ArrayField
+from django.db.models import Count, F, OuterRef, Subquery, Sum, TextField, Value
+from django.db.models.functions import Coalesce
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 
 from components.users.models import User
 
@@ -24,6 +28,45 @@ class BookCategory(models.Model):
         return self.name
 
 
+class BookQuerySet(models.QuerySet):
+
+    def update_search_vector(self):
+        # Category names are denormalized into the document through a correlated
+        # subquery so the whole refresh stays a single UPDATE without joins.
+        category_names = BookCategory.objects.filter(book=OuterRef('pk')).values('book').annotate(
+            names=StringAgg('name', delimiter=' ')).values('names')
+        return self.update(search_vector=(
+            SearchVector('name', weight='A') +
+            SearchVector(Subquery(category_names, output_field=TextField()), weight='B') +
+            SearchVector('description', weight='C')
+        ))
+
+    def add_read_status_stats(self, before=None, after=None):
+        """Move the stored aggregates by the difference between two BookReadStatus.stats() values."""
+        before = before or {}
+        after = after or {}
+        deltas = {name: after.get(name, 0) - before.get(name, 0) for name in BookReadStatus.STATS_FIELDS}
+        updates = {name: F(name) + delta for name, delta in deltas.items() if delta}
+        if not updates:
+            return 0
+        return self.update(**updates)
+
+    def rebuild_read_status_stats(self):
+        """Recompute the stored aggregates of these books from BookReadStatus."""
+        def aggregate(expression, **filters):
+            statuses = BookReadStatus.objects.filter(book=OuterRef('pk'), **filters).order_by().values('book')
+            return Coalesce(Subquery(statuses.annotate(value=expression).values('value')), Value(0))
+
+        return self.update(
+            rating_sum=aggregate(Sum('rating'), rating__gt=0),
+            rating_count=aggregate(Count('pk'), rating__gt=0),
+            reader_count=aggregate(Count('pk'), status__in=BookReadStatus.READER_STATUSES),
+            reading_count=aggregate(Count('pk'), status=BookReadStatus.STATUS_CHOICES[1][0]),
+            read_count=aggregate(Count('pk'), status=BookReadStatus.STATUS_CHOICES[2][0]),
+            favorite_count=aggregate(Count('pk'), is_favorite=True),
+        )
+
+
 class Book(BookBase):
     LANGUAGE_CHOICES = (
         (0, 'VN'),
@@ -40,13 +83,32 @@ class Book(BookBase):
     language = models.IntegerField(choices=LANGUAGE_CHOICES, default=0)
     publisher = models.CharField(max_length=256, null=True, blank=True)
     price = models.IntegerField(default=0)
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Aggregates of BookReadStatus, kept up to date by the views writing statuses
+    rating_sum = models.IntegerField(default=0, editable=False)
+    rating_count = models.IntegerField(default=0, editable=False)
+    reader_count = models.IntegerField(default=0, editable=False)
+    reading_count = models.IntegerField(default=0, editable=False)
+    read_count = models.IntegerField(default=0, editable=False)
+    favorite_count = models.IntegerField(default=0, editable=False)
+
+    objects = BookQuerySet.as_manager()
 
     class Meta:
         db_table = 'book'
+        indexes = [
+            GinIndex(fields=['search_vector']),
+            models.Index(fields=['-reader_count']),
+            models.Index(fields=['is_activate', 'updated_at', 'id']),
+        ]
 
     def __str__(self):
         return self.name
 
+    @property
+    def rating(self):
+        return round(self.rating_sum / self.rating_count) if self.rating_count else 0
+
 
 class BookReadStatus(BookBase):
     STATUS_CHOICES = (
@@ -54,9 +116,11 @@ class BookReadStatus(BookBase):
         (1, 'reading'),
         (2, 'read'),
     )
+    READER_STATUSES = (1, 2)
+    STATS_FIELDS = ('rating_sum', 'rating_count', 'reader_count', 'reading_count', 'read_count', 'favorite_count')
 
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
-    user = models.ManyToManyField(User)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
     status = models.IntegerField(choices=STATUS_CHOICES, default=0)
     page_reading = models.IntegerField(default=0)
     is_favorite = models.BooleanField(default=False)
@@ -64,10 +128,28 @@ class BookReadStatus(BookBase):
 
     class Meta:
         db_table = 'book_read_status'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'book'], name='book_read_status_user_book_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'status', 'book']),
+            models.Index(fields=['user', 'is_favorite', 'book']),
+        ]
 
     def __str(self):
         return self.page_reading
 
+    def stats(self):
+        """Contribution of this status to the aggregates stored on its book."""
+        return {
+            'rating_sum': self.rating,
+            'rating_count': 1 if self.rating else 0,
+            'reader_count': 1 if self.status in self.READER_STATUSES else 0,
+            'reading_count': 1 if self.status == self.STATUS_CHOICES[1][0] else 0,
+            'read_count': 1 if self.status == self.STATUS_CHOICES[2][0] else 0,
+            'favorite_count': 1 if self.is_favorite else 0,
+        }
+
 
 class BookRequestBuy(BookBase):
     STATUS_CHOICES = (
@@ -85,17 +167,24 @@ class BookRequestBuy(BookBase):
 
     class Meta:
         db_table = 'book_request_buy'
+        indexes = [
+            models.Index(fields=['is_activate', 'updated_at', 'id']),
+        ]
 
     def __str__(self):
         return self.book_url
 
 
-class BookReview(BookBase):
-    book = models.OneToOneField(Book, on_delete=models.CASCADE)
-    messages = ArrayField(ArrayField(models.CharField(max_length=512, blank=True), size=5))
+class BookComment(BookBase):
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='comments')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='book_comments')
+    body = models.CharField(max_length=512)
 
     class Meta:
-        db_table = 'book_review'
+        db_table = 'book_comment'
+        indexes = [
+            models.Index(fields=['book', '-created_at']),
+        ]
 
     def __str__(self):
-        return self.book.name
+        return self.body
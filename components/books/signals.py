@@ -0,0 +1,59 @@
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from .cache import invalidate_books, invalidate_categories
+from .models import Book, BookCategory, BookReadStatus
+
+
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance, **kwargs):
+    Book.objects.filter(pk=instance.pk).update_search_vector()
+    invalidate_books([instance.pk])
+
+
+@receiver(post_delete, sender=Book)
+def book_deleted(sender, instance, **kwargs):
+    invalidate_books([instance.pk])
+    invalidate_categories()
+
+
+@receiver(post_save, sender=BookCategory)
+def book_category_saved(sender, instance, created, **kwargs):
+    invalidate_categories()
+    if not created:
+        books = Book.objects.filter(book_category=instance)
+        books.update_search_vector()
+        invalidate_books(books.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=BookCategory)
+def book_category_deleted(sender, instance, **kwargs):
+    invalidate_categories()
+    invalidate_books(list(instance.book_set.values_list('pk', flat=True)))
+
+
+@receiver(m2m_changed, sender=Book.book_category.through)
+def book_category_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # pk_set is not provided on clear, remember the books losing this category
+        instance._cleared_book_ids = list(instance.book_set.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    invalidate_categories()
+    if not reverse:
+        Book.objects.filter(pk=instance.pk).update_search_vector()
+        invalidate_books([instance.pk])
+        return
+    if action == 'post_clear':
+        pk_set = getattr(instance, '_cleared_book_ids', None)
+    if pk_set:
+        Book.objects.filter(pk__in=pk_set).update_search_vector()
+        invalidate_books(pk_set)
+
+
+@receiver(post_save, sender=BookReadStatus)
+@receiver(post_delete, sender=BookReadStatus)
+def book_read_status_changed(sender, instance, **kwargs):
+    # The rating and reader counters of the detail header follow every read status change
+    invalidate_books([instance.book_id])
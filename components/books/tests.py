@@ -1,3 +1,737 @@
-from django.test import TestCase
+import glob
+import os
+import re
+import shutil
+import tempfile
+from io import StringIO
+from threading import Barrier, Thread
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, router
+from django.db.models import QuerySet
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.http import HttpResponse
+from django.urls import reverse
+
+from components.users.models import User
+from utility.perf import PerfRecorder, get_perf_recorder
+from utility.postgresql.base import DatabaseWrapper
+from utility.migrationtest import MigrationTestCase
+from utility.querycheck import QueryBudgetTestMixin
+from utility.replica import ReplicaMiddleware, use_primary
+from . import urls as book_urls
+from .cache import get_book, invalidate_books
+from .models import Book, BookCategory, BookComment, BookReadStatus, BookRequestBuy
+from .views import BookCreateView, BookDetailView, BookReviewCreateView
+
+
+class BookPageQueryBudgetTest(QueryBudgetTestMixin, TestCase):
+    """Pages must run a fixed number of queries, whatever the number of rows they show."""
+    QUERY_BUDGET = 10
+    ROWS = 30
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='admin', email='admin@sun-asterisk.com', is_activate=True,
+                                       role=User.ROLE_ADMIN)
+        categories = [BookCategory.objects.create(name=f'Category {i}') for i in range(3)]
+        for i in range(cls.ROWS):
+            book = Book.objects.create(name=f'Book {i}', description=f'Description {i}')
+            book.book_category.set(categories)
+
+            requester = User.objects.create(username=f'requester{i}', email=f'requester{i}@sun-asterisk.com')
+            request_buy = BookRequestBuy.objects.create(name=f'Book {i}', book_url='https://example.com/',
+                                                        user=requester)
+            request_buy.book_category.set(categories)
+            BookReadStatus.objects.create(book=book, user=requester, status=1, rating=i % 5 + 1)
+            BookComment.objects.create(book=book, user=requester, body=f'Comment {i}')
+        cls.book = book
+        cls.request_buy = request_buy
+        BookComment.objects.bulk_create([
+            BookComment(book=cls.book, user=cls.user, body=f'Comment {i}') for i in range(cls.ROWS)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_book_urls(self):
+        self.assertUrlsQueryBudget('book', book_urls.urlpatterns, url_kwargs={
+            None: {'id': self.book.id},
+            'edit-request-buy': {'id': self.request_buy.id},
+        }, skip=['book-search'])
+
+    def test_book_search(self):
+        self.assertQueryBudget(reverse('book:book-search') + '?q=book')
+
+    def test_book_list_filters(self):
+        self.assertQueryBudget(reverse('book:book-list') + '?category=Category+1&reading=true&favorited=true')
+
+    def test_n_plus_one_is_reported(self):
+        # The list without its prefetch runs one categories query per book
+        with mock.patch.object(QuerySet, 'prefetch_related', lambda queryset, *lookups: queryset):
+            with self.assertRaisesMessage(AssertionError, 'book_list.html:'):
+                self.assertQueryBudget(reverse('book:book-list'))
+
+
+class BookSearchVectorTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='member', email='member@sun-asterisk.com', is_activate=True)
+        cls.category = BookCategory.objects.create(name='Astronomy')
+        cls.book = Book.objects.create(name='Cosmos', description='Stories')
+
+    def search(self, text):
+        return list(Book.objects.filter(search_vector=SearchQuery(text)).values_list('name', flat=True))
+
+    def test_book_save(self):
+        self.assertEqual(self.search('cosmos'), ['Cosmos'])
+        self.book.name = 'Contact'
+        self.book.save()
+        self.assertEqual(self.search('cosmos'), [])
+        self.assertEqual(self.search('contact'), ['Contact'])
+
+    def test_category_changes(self):
+        self.book.book_category.add(self.category)
+        self.assertEqual(self.search('astronomy'), ['Cosmos'])
+        self.book.book_category.remove(self.category)
+        self.assertEqual(self.search('astronomy'), [])
+        self.book.book_category.add(self.category)
+        self.book.book_category.clear()
+        self.assertEqual(self.search('astronomy'), [])
+
+    def test_reverse_category_changes(self):
+        self.category.book_set.add(self.book)
+        self.assertEqual(self.search('astronomy'), ['Cosmos'])
+        self.category.book_set.remove(self.book)
+        self.assertEqual(self.search('astronomy'), [])
+        self.category.book_set.add(self.book)
+        # Only the pre_clear signal knows the books losing the category
+        self.category.book_set.clear()
+        self.assertEqual(self.search('astronomy'), [])
+
+    def test_category_rename(self):
+        self.book.book_category.add(self.category)
+        self.category.name = 'Cosmology'
+        self.category.save()
+        self.assertEqual(self.search('astronomy'), [])
+        self.assertEqual(self.search('cosmology'), ['Cosmos'])
+
+    def test_results_are_ranked(self):
+        # Matches in the name weigh more than in the categories, which weigh more than in the description
+        Book.objects.create(name='Atlas', description='Planets seen from a telescope')
+        Book.objects.create(name='Telescope', description='Stories')
+        Book.objects.create(name='Handbook', description='Stories').book_category.add(
+            BookCategory.objects.create(name='Telescope'))
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('book:book-search'), {'q': 'telescope'})
+        self.assertEqual([book.name for book in response.context['books']], ['Telescope', 'Handbook', 'Atlas'])
+
+
+class BookListShelfFilterTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='member', email='member@sun-asterisk.com', is_activate=True)
+        other = User.objects.create(username='other', email='other@sun-asterisk.com', is_activate=True)
+        cls.reading, cls.read, cls.favorite, cls.other_reading = [
+            Book.objects.create(name=name, description=name) for name in ('reading', 'read', 'favorite', 'other')
+        ]
+        for book, user, status, is_favorite in [(cls.reading, cls.user, 1, False),
+                                                (cls.read, cls.user, 2, False),
+                                                (cls.favorite, cls.user, 0, True),
+                                                (cls.other_reading, other, 1, True)]:
+            BookReadStatus.objects.create(book=book, user=user, status=status, is_favorite=is_favorite)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def get_book_names(self, query):
+        response = self.client.get(reverse('book:book-list') + query)
+        return sorted(book.name for book in response.context['books'])
+
+    def test_single_shelf(self):
+        self.assertEqual(self.get_book_names('?reading=true'), ['reading'])
+        self.assertEqual(self.get_book_names('?favorited=true'), ['favorite'])
+
+    def test_combined_shelves(self):
+        self.assertEqual(self.get_book_names('?reading=true&read=true&favorited=true'), ['favorite', 'read', 'reading'])
+
+    def test_user_status_is_annotated(self):
+        response = self.client.get(reverse('book:book-list'))
+        statuses = {book.name: (book.user_status, book.user_is_favorite) for book in response.context['books']}
+        self.assertEqual(statuses['reading'], (1, False))
+        self.assertEqual(statuses['other'], (None, None))
+
+
+@override_settings(LIST_PAGINATION='keyset')
+class BookListKeysetPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='member', email='member@sun-asterisk.com', is_activate=True)
+        for i in range(60):
+            Book.objects.create(name=f'Book {i}', description=f'Description {i}')
+        # Equal timestamps must still be ordered by id across pages
+        Book.objects.filter(pk__in=Book.objects.order_by('pk').values('pk')[20:40]).update(
+            updated_at=Book.objects.order_by('pk')[20].updated_at)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_walk_forward_and_back(self):
+        expected = list(Book.objects.order_by('-updated_at', '-id').values_list('id', flat=True))
+        seen, pages, cursor = [], [], ''
+        while cursor is not None:
+            page = self.client.get(reverse('book:book-list'), {'cursor': cursor}).context['books']
+            pages.append(page)
+            seen.extend(book.id for book in page)
+            cursor = page.next_cursor
+        self.assertEqual(seen, expected)
+        self.assertEqual(pages[0].count, 60)
+
+        page = self.client.get(reverse('book:book-list'), {'cursor': pages[-1].previous_cursor}).context['books']
+        self.assertEqual([book.id for book in page], [book.id for book in pages[-2]])
+
+    @override_settings(APPROXIMATE_COUNT_THRESHOLD=0)
+    def test_list_runs_no_count(self):
+        # The first request fills the category cache, its query counts the books of each category
+        self.client.get(reverse('book:book-list'))
+        with CaptureQueriesContext(connection) as context:
+            page = self.client.get(reverse('book:book-list')).context['books']
+        self.assertTrue(page.is_approximate_count)
+        self.assertFalse([query['sql'] for query in context.captured_queries if 'COUNT(' in query['sql']])
+
+
+class BookRatingCreateViewTest(TransactionTestCase):
+
+    def setUp(self):
+        self.book = Book.objects.create(name='Book', description='Description')
+        self.users = [User.objects.create(username=f'member{i}', email=f'member{i}@sun-asterisk.com',
+                                          is_activate=True) for i in range(5)]
+
+    def rate(self, user, rating, barrier=None):
+        client = Client()
+        client.force_login(user)
+        try:
+            if barrier:
+                barrier.wait()
+            client.post(reverse('book:book-rating', kwargs={'id': self.book.id}), {'rating': rating})
+        finally:
+            connection.close()
+
+    def rate_concurrently(self, ratings):
+        barrier = Barrier(len(ratings))
+        threads = [Thread(target=self.rate, args=(user, rating, barrier)) for user, rating in ratings]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_rating_updates_own_status(self):
+        self.rate(self.users[0], 2)
+        self.rate(self.users[1], 5)
+        self.rate(self.users[0], 4)
+        self.assertEqual(dict(BookReadStatus.objects.values_list('user__username', 'rating')),
+                         {'member0': 4, 'member1': 5})
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.rating_sum, self.book.rating_count), (9, 2))
+
+    def test_concurrent_raters(self):
+        self.rate_concurrently([(user, i + 1) for i, user in enumerate(self.users)])
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.rating_sum, self.book.rating_count), (15, 5))
+        self.assertEqual(BookReadStatus.objects.filter(book=self.book).count(), 5)
+
+    def test_concurrent_ratings_of_one_user(self):
+        self.rate_concurrently([(self.users[0], rating) for rating in (1, 2, 3, 4)])
+        status = BookReadStatus.objects.get(book=self.book, user=self.users[0])
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.rating_sum, self.book.rating_count), (status.rating, 1))
+
+
+class BookReadStatusStatsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create(username=f'member{i}', email=f'member{i}@sun-asterisk.com',
+                                         is_activate=True) for i in range(2)]
+        cls.book = Book.objects.create(name='Book', description='Description', paperback=100)
+
+    def setUp(self):
+        self.client.force_login(self.users[0])
+
+    def get_stats(self):
+        self.book.refresh_from_db()
+        return {name: getattr(self.book, name) for name in ('reader_count', 'reading_count', 'read_count',
+                                                            'favorite_count')}
+
+    def test_mark_reading_then_read(self):
+        url = reverse('book:book-mark', kwargs={'id': self.book.id})
+        self.client.post(url, {'page_reading': 10})
+        self.assertEqual(self.get_stats(), {'reader_count': 1, 'reading_count': 1, 'read_count': 0,
+                                            'favorite_count': 0})
+        self.client.post(url, {'page_reading': 100})
+        self.assertEqual(self.get_stats(), {'reader_count': 1, 'reading_count': 0, 'read_count': 1,
+                                            'favorite_count': 0})
+        self.client.post(url, {'page_reading': 50})
+        self.assertEqual(self.get_stats(), {'reader_count': 1, 'reading_count': 1, 'read_count': 0,
+                                            'favorite_count': 0})
+
+    def test_favorite_then_unfavorite(self):
+        url = reverse('book:book-like', kwargs={'id': self.book.id})
+        self.client.post(url, {'is_favorite': 1})
+        self.assertEqual(self.get_stats()['favorite_count'], 1)
+        self.client.post(url, {'is_favorite': 0})
+        self.assertEqual(self.get_stats()['favorite_count'], 0)
+        self.client.post(url, {'is_favorite': 1})
+        self.assertEqual(self.get_stats()['favorite_count'], 1)
+        # Favouriting without reading does not make a reader
+        self.assertEqual(self.get_stats()['reader_count'], 0)
+
+    def test_rebuild_book_stats(self):
+        BookReadStatus.objects.create(book=self.book, user=self.users[0], status=1, rating=4, is_favorite=True)
+        BookReadStatus.objects.create(book=self.book, user=self.users[1], status=2, rating=2)
+        empty = Book.objects.create(name='Empty', description='Description')
+        Book.objects.update(rating_sum=42, rating_count=7, reader_count=9, reading_count=5, read_count=3,
+                            favorite_count=8)
+
+        call_command('rebuild_book_stats', batch_size=1, stdout=StringIO())
+
+        self.book.refresh_from_db()
+        empty.refresh_from_db()
+        self.assertEqual([getattr(self.book, name) for name in BookReadStatus.STATS_FIELDS], [6, 2, 2, 1, 1, 1])
+        self.assertEqual([getattr(empty, name) for name in BookReadStatus.STATS_FIELDS], [0] * 6)
+
+
+class BookCacheInvalidationTest(TransactionTestCase):
+    """Cached categories and detail headers are dropped once a change commits."""
+    # Outside of a transaction the pages read from the read replicas (test mirrors of default) when configured
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='member', email='member@sun-asterisk.com', is_activate=True)
+        self.category = BookCategory.objects.create(name='Novel')
+        self.book = Book.objects.create(name='Book', description='Description')
+        self.book.book_category.add(self.category)
+        self.client.force_login(self.user)
+
+    def get_detail(self):
+        return self.client.get(reverse('book:book-detail', kwargs={'id': self.book.id}))
+
+    def get_categories(self):
+        response = self.client.get(reverse('book:book-category'))
+        return {category.name: category.num_book for category in response.context['categories']}
+
+    def test_detail_header_is_cached(self):
+        self.get_detail()
+        with CaptureQueriesContext(connection) as context:
+            self.get_detail()
+        self.assertFalse([query['sql'] for query in context.captured_queries
+                          if 'FROM "book" ' in query['sql'] or '"book_category"' in query['sql']])
+
+    def test_detail_follows_book_changes(self):
+        self.get_detail()
+        self.book.name = 'Renamed book'
+        self.book.save()
+        self.assertEqual(self.get_detail().context['book'].name, 'Renamed book')
+
+        self.category.name = 'Fiction'
+        self.category.save()
+        self.assertEqual([c.name for c in self.get_detail().context['book'].book_category.all()], ['Fiction'])
+
+    def test_row_cached_after_a_commit_is_not_served(self):
+        changes = [lambda: Book.objects.filter(pk=self.book.pk).update(name='Renamed book'),
+                   lambda: invalidate_books([self.book.pk])]
+        cache_set = cache.set
+
+        def set_after_commit(*args, **kwargs):
+            # Another request commits a change between the read of the row and its caching
+            while changes:
+                changes.pop(0)()
+            cache_set(*args, **kwargs)
+
+        with mock.patch.object(cache, 'set', set_after_commit):
+            self.assertEqual(get_book(self.book.pk).name, 'Book')
+        self.assertEqual(get_book(self.book.pk).name, 'Renamed book')
+
+    def test_detail_follows_rating(self):
+        self.get_detail()
+        self.client.post(reverse('book:book-rating', kwargs={'id': self.book.id}), {'rating': 4})
+        self.assertEqual(self.get_detail().context['rating'], 4)
+
+    def test_category_counts_follow_m2m_changes(self):
+        self.assertEqual(self.get_categories(), {'Novel': 1})
+        other = Book.objects.create(name='Other', description='Description')
+        other.book_category.add(self.category)
+        self.assertEqual(self.get_categories(), {'Novel': 2})
+        self.category.book_set.clear()
+        self.assertEqual(self.get_categories(), {'Novel': 0})
+        BookCategory.objects.create(name='Poetry')
+        self.assertEqual(self.get_categories(), {'Novel': 0, 'Poetry': 0})
+
+
+class BookConditionalGetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='member', email='member@sun-asterisk.com', is_activate=True)
+        cls.other = User.objects.create(username='other', email='other@sun-asterisk.com', is_activate=True)
+        cls.book = Book.objects.create(name='Book', description='Description')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def get_etag(self, url):
+        # The first response sets the CSRF cookie, part of the validators
+        self.client.get(url)
+        return self.client.get(url)['ETag']
+
+    def assertRevalidates(self, url, change):
+        etag = self.get_etag(url)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        change()
+        cache.clear()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_detail_follows_comments(self):
+        self.assertRevalidates(reverse('book:book-detail', kwargs={'id': self.book.id}),
+                               lambda: BookComment.objects.create(book=self.book, user=self.other, body='Comment'))
+
+    def test_detail_follows_comment_authors(self):
+        BookComment.objects.create(book=self.book, user=self.other, body='Comment')
+
+        def rename():
+            self.other.username = 'renamed'
+            self.other.save()
+        self.assertRevalidates(reverse('book:book-detail', kwargs={'id': self.book.id}), rename)
+
+    def test_detail_follows_own_status(self):
+        self.assertRevalidates(reverse('book:book-detail', kwargs={'id': self.book.id}),
+                               lambda: BookReadStatus.objects.create(book=self.book, user=self.user, is_favorite=True))
+
+    def test_detail_ignores_other_readers_status(self):
+        url = reverse('book:book-detail', kwargs={'id': self.book.id})
+        etag = self.get_etag(url)
+        BookReadStatus.objects.create(book=self.book, user=self.other, is_favorite=True)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_list_follows_books(self):
+        self.assertRevalidates(reverse('book:book-list'),
+                               lambda: Book.objects.create(name='Other book', description='Description'))
+
+    def test_list_follows_own_status(self):
+        self.assertRevalidates(reverse('book:book-list'),
+                               lambda: BookReadStatus.objects.create(book=self.book, user=self.user, status=1))
+
+
+class CompressedManifestStaticFilesStorageTest(SimpleTestCase):
+
+    def setUp(self):
+        source_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source_dir)
+        self.static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.static_root)
+        files = {
+            'css/site.css': b'.book { background: url("../img/cover.png"); }\n' * 200,
+            'css/plugin.css': b'.icon { background: url("missing.png"); }\n' * 200,
+            'js/tiny.js': b'x',
+            'img/cover.png': b'\x89PNG' * 1000,
+        }
+        for name, content in files.items():
+            path = os.path.join(source_dir, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(content)
+        settings_override = override_settings(
+            STATIC_ROOT=self.static_root, STATICFILES_DIRS=[source_dir],
+            STATICFILES_STORAGE='utility.storage.CompressedManifestStaticFilesStorage',
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def collected(self, pattern):
+        return sorted(os.path.relpath(path, self.static_root)
+                      for path in glob.glob(os.path.join(self.static_root, pattern)))
+
+    def test_collectstatic(self):
+        with self.assertLogs('utility.storage', 'WARNING') as logs:
+            call_command('collectstatic', interactive=False, verbosity=0)
+
+        # Only the hashed copies of compressible files that shrink enough get a .gz variant
+        self.assertEqual([name.split('.')[0] for name in self.collected('*/*.gz')], ['css/plugin', 'css/site'])
+        self.assertTrue(all(re.match(r'css/\w+\.[0-9a-f]{12}\.css\.gz$', name) for name in self.collected('*/*.gz')))
+        self.assertEqual(len(self.collected('js/tiny.*.js')), 1)
+        self.assertEqual(len(self.collected('img/cover.*.png')), 1)
+
+        # A missing reference is logged and kept as is while the other urls are hashed
+        self.assertIn('css/plugin.css references a missing file: url("missing.png")', logs.output[0])
+        [plugin] = self.collected('css/plugin.*.css')
+        with open(os.path.join(self.static_root, plugin)) as f:
+            self.assertIn('url("missing.png")', f.read())
+        [site] = self.collected('css/site.*.css')
+        with open(os.path.join(self.static_root, site)) as f:
+            self.assertRegex(f.read(), r'url\("\.\./img/cover\.[0-9a-f]{12}\.png"\)')
+
+
+class PerformanceMiddlewareTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='member', email='member@sun-asterisk.com', is_activate=True)
+        Book.objects.create(name='Book', description='Description')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('book:book-list'))
+        server_timing = response['Server-Timing']
+        self.assertIn(f'desc="{len(context)} queries, 0 connections opened"', server_timing)
+        self.assertTrue(re.search(r'tpl;dur=[0-9.]+', server_timing))
+        self.assertIn('book:book-list', get_perf_recorder().snapshot())
+
+    def test_n_plus_one_is_logged(self):
+        category = BookCategory.objects.create(name='Category')
+        for index in range(3):
+            Book.objects.create(name=f'Book {index}', description='Description').book_category.add(category)
+        with override_settings(PERF={**settings.PERF, 'N_PLUS_ONE_THRESHOLD': 3}):
+            with self.assertLogs('utility.perf', 'WARNING') as logs:
+                with mock.patch.object(QuerySet, 'prefetch_related', lambda queryset, *lookups: queryset):
+                    self.client.get(reverse('book:book-list'))
+        self.assertIn('book_list.html:', logs.output[0])
+
+    def test_perf_report(self):
+        sink_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, sink_dir)
+        recorder = PerfRecorder(sink_dir, flush_interval=3600)
+        for ms in (10, 20, 30):
+            recorder.record('book:book-list', {'total': ms, 'db': 1, 'queries': 5, 'mongo': 0, 'template': 2})
+        recorder.flush()
+        # The same histograms written by a second process are merged
+        [path] = glob.glob(os.path.join(sink_dir, 'perf-*.json'))
+        shutil.copy(path, os.path.join(sink_dir, 'perf-0.json'))
+
+        output = StringIO()
+        call_command('perf_report', sink_dir=sink_dir, stdout=output)
+        view_name, count, p50, p95 = output.getvalue().splitlines()[1].split()[:4]
+        self.assertEqual((view_name, count), ('book:book-list', '6'))
+        self.assertAlmostEqual(float(p50), 20, delta=2)
+        self.assertAlmostEqual(float(p95), 30, delta=3)
+
+
+class DatabaseHealthCheckTest(SimpleTestCase):
+
+    def connect(self, **options):
+        wrapper = DatabaseWrapper(dict(connection.settings_dict, **options), alias='health-check')
+        self.addCleanup(wrapper.close)
+        wrapper.ensure_connection()
+        return wrapper
+
+    def test_dropped_connection_is_replaced(self):
+        wrapper = self.connect(CONN_MAX_AGE=60, CONN_HEALTH_CHECKS=True)
+        # Next request, the server dropped the connection while the worker was idle
+        wrapper.close_if_unusable_or_obsolete()
+        with self.connect().cursor() as cursor:
+            cursor.execute('SELECT pg_terminate_backend(%s)', [wrapper.connection.get_backend_pid()])
+
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        events = get_perf_recorder().events_snapshot()
+        self.assertEqual(sum(events['db.health-check.unusable'].values()), 1)
+        self.assertGreaterEqual(sum(events['db.health-check.opened'].values()), 3)
+
+    def test_connection_is_checked_once_per_request(self):
+        wrapper = self.connect(CONN_MAX_AGE=60, CONN_HEALTH_CHECKS=True)
+        wrapper.close_if_unusable_or_obsolete()
+        with mock.patch.object(wrapper, 'is_usable', return_value=True) as is_usable:
+            for _ in range(3):
+                with wrapper.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+        self.assertEqual(is_usable.call_count, 1)
+
+
+class BookCatalogueImportExportTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as catalogue:
+            catalogue.write(content)
+        return path
+
+    def test_import_csv(self):
+        existing = Book.objects.create(name='Dune', author='Frank Herbert', description='Old', price=1)
+        existing.book_category.add(BookCategory.objects.create(name='Old category'))
+        path = self.write('books.csv', '\n'.join([
+            'name,author,description,categories,language,price',
+            ' dune ,FRANK HERBERT,Desert planet,Fiction|Classics,EN,120000',
+            'Emma,Jane Austen,A novel,Fiction,VN,',
+            'Emma,Jane Austen,A novel (second edition),Fiction,JP,90000',
+            ',Nobody,No name,,EN,1',
+            'Bad price,Someone,Text,,EN,cheap',
+        ]))
+        rejects = os.path.join(self.directory, 'rejects.csv')
+        output = StringIO()
+        call_command('import_books', path, batch_size=3, rejects=rejects, stdout=output, stderr=StringIO())
+
+        self.assertIn('1 created, 1 updated, 0 unchanged, 1 skipped, 2 rejected', output.getvalue())
+        existing.refresh_from_db()
+        self.assertEqual((existing.description, existing.price, existing.language), ('Desert planet', 120000, 2))
+        self.assertEqual(sorted(existing.book_category.values_list('name', flat=True)), ['Classics', 'Fiction'])
+        emma = Book.objects.get(name='Emma')
+        self.assertEqual((emma.description, emma.language), ('A novel (second edition)', 1))
+        self.assertEqual(BookCategory.objects.filter(name='Fiction').count(), 1)
+        self.assertTrue(Book.objects.filter(pk=emma.pk, search_vector__isnull=False).exists())
+        with open(rejects) as rejected:
+            self.assertEqual([line.split(',')[0] for line in rejected.read().splitlines()], ['name', '', 'Bad price'])
+
+    def test_export_import_round_trip(self):
+        book = Book.objects.create(name='Emma', author='Jane Austen', description='A novel', language=2)
+        book.book_category.add(BookCategory.objects.create(name='Fiction'),
+                               BookCategory.objects.create(name='Classics'))
+        Book.objects.create(name='No category', description='Text')
+        for file_format in ('csv', 'jsonl'):
+            path = os.path.join(self.directory, f'books.{file_format}')
+            call_command('export_books', path, batch_size=1, stdout=StringIO())
+            with open(path) as exported:
+                content = exported.read()
+            self.assertIn('Classics|Fiction' if file_format == 'csv' else '["Classics", "Fiction"]', content)
+            # Behind a transaction pooler the rows are paged by primary key instead of a server side cursor
+            with mock.patch.dict(connection.settings_dict, DISABLE_SERVER_SIDE_CURSORS=True):
+                call_command('export_books', path, batch_size=1, stdout=StringIO())
+            with open(path) as exported:
+                self.assertEqual(exported.read(), content)
+
+            output = StringIO()
+            call_command('import_books', path, dry_run=True, stdout=output)
+            self.assertIn('0 created, 0 updated, 2 unchanged, 0 skipped, 0 rejected', output.getvalue())
+
+
+@override_settings(READ_REPLICAS={'ALIASES': ['replica1'], 'STICKY_SECONDS': 5, 'COOKIE_NAME': 'primary_until'})
+class ReplicaRoutingTest(SimpleTestCase):
+
+    def route(self, request, view_class):
+        """Run a request through ReplicaMiddleware, return the database a read of its view goes to."""
+        databases = []
+
+        def get_response(request):
+            middleware.process_view(request, view_class.as_view(), (), {})
+            databases.append(router.db_for_read(Book))
+            with use_primary():
+                databases.append(router.db_for_read(Book))
+            return HttpResponse()
+
+        middleware = ReplicaMiddleware(get_response)
+        response = middleware(request)
+        self.assertEqual(databases[1], 'default')
+        self.assertEqual(router.db_for_read(Book), 'default')
+        return databases[0], response
+
+    def test_read_only_views_use_the_replica(self):
+        factory = RequestFactory()
+        self.assertEqual(self.route(factory.get('/'), BookDetailView)[0], 'replica1')
+        self.assertEqual(self.route(factory.get('/'), BookCreateView)[0], 'default')
+
+    def test_reads_stick_to_the_primary_after_a_write(self):
+        factory = RequestFactory()
+        database, response = self.route(factory.post('/'), BookReviewCreateView)
+        self.assertEqual(database, 'default')
+        cookie = response.cookies['primary_until']
+        self.assertEqual(cookie['max-age'], 5)
+
+        request = factory.get('/')
+        request.COOKIES['primary_until'] = cookie.value
+        self.assertEqual(self.route(request, BookDetailView)[0], 'default')
+        request.COOKIES['primary_until'] = '0'
+        self.assertEqual(self.route(request, BookDetailView)[0], 'replica1')
+
+
+class CopyBookReviewMessagesMigrationTest(MigrationTestCase):
+    migrate_from = ('books', '0015_book_comment')
+    migrate_to = ('books', '0016_copy_book_review_messages')
+
+    def setUp(self):
+        super().setUp()
+        User = self.old_apps.get_model('users', 'User')
+        Book = self.old_apps.get_model('books', 'Book')
+        BookReview = self.old_apps.get_model('books', 'BookReview')
+        self.user = User.objects.create(username='member', email='member@sun-asterisk.com')
+        self.books = [Book.objects.create(name=f'Book {i}', description='Description') for i in range(2)]
+        for book in self.books:
+            BookReview.objects.create(book=book, messages=[
+                ['member', f'{book.name} review', '05/01/2020, 12:00:00', str(self.user.id), ''],
+                ['gone', 'Lost review', '05/01/2020, 12:01:00', str(self.user.id + 1000), ''],
+                ['member', 'Undated review', 'yesterday', str(self.user.id), ''],
+            ])
+
+    def run_copy(self):
+        return self.migrate().get_model('books', 'BookComment')
+
+    def test_copy(self):
+        with self.assertLogs('components.books.migrations', 'WARNING') as logs:
+            BookComment = self.run_copy()
+        self.assertEqual(logs.output, ['WARNING:components.books.migrations.0016_copy_book_review_messages:'
+                                       'Skipped 2 review messages without an existing user'])
+        self.assertEqual(sorted(BookComment.objects.values_list('book__name', 'body', 'user_id')), [
+            ('Book 0', 'Book 0 review', self.user.id), ('Book 0', 'Undated review', self.user.id),
+            ('Book 1', 'Book 1 review', self.user.id), ('Book 1', 'Undated review', self.user.id),
+        ])
+        created_at = BookComment.objects.get(body='Book 0 review').created_at
+        self.assertEqual((created_at.year, created_at.month, created_at.day), (2020, 5, 1))
+
+    def test_run_again_after_partial_copy(self):
+        self.old_apps.get_model('books', 'BookComment').objects.create(book_id=self.books[0].id,
+                                                                       user_id=self.user.id, body='Copied before')
+        BookComment = self.run_copy()
+        self.assertEqual(list(BookComment.objects.filter(book_id=self.books[0].id).values_list('body', flat=True)),
+                         ['Copied before'])
+        self.assertEqual(BookComment.objects.filter(book_id=self.books[1].id).count(), 2)
+
+
+class CollapseBookReadStatusReadersMigrationTest(MigrationTestCase):
+    migrate_from = ('books', '0019_bookreadstatus_user_fk')
+    migrate_to = ('books', '0020_collapse_bookreadstatus_readers')
+
+    def test_collapse(self):
+        User = self.old_apps.get_model('users', 'User')
+        Book = self.old_apps.get_model('books', 'Book')
+        BookReadStatus = self.old_apps.get_model('books', 'BookReadStatus')
+        member0, member1 = [User.objects.create(username=f'member{i}', email=f'member{i}@sun-asterisk.com')
+                            for i in range(2)]
+        book = Book.objects.create(name='Book', description='Description')
+        shared = BookReadStatus.objects.create(book=book, status=1, rating=4)
+        shared.readers.add(member0, member1)
+        BookReadStatus.objects.create(book=book, status=2).readers.add(member0)
+        BookReadStatus.objects.create(book=book, status=1, is_favorite=True)
+        # The counters as they were kept, one count per status row
+        Book.objects.filter(pk=book.pk).update(rating_sum=4, rating_count=1, reader_count=3, reading_count=2,
+                                               read_count=1, favorite_count=1)
+
+        apps = self.migrate()
+        BookReadStatus = apps.get_model('books', 'BookReadStatus')
+        self.assertEqual(sorted(BookReadStatus.objects.values_list('user__username', 'status', 'rating')),
+                         [('member0', 2, 4), ('member1', 1, 4)])
+        self.assertEqual(
+            apps.get_model('books', 'Book').objects.values(
+                'rating_sum', 'rating_count', 'reader_count', 'reading_count', 'read_count', 'favorite_count'
+            ).get(pk=book.pk),
+            {'rating_sum': 8, 'rating_count': 2, 'reader_count': 2, 'reading_count': 1, 'read_count': 1,
+             'favorite_count': 0}
+        )
+        # One row per (user, book) is left for the unique constraint
+        self.migrate(('books', '0021_bookreadstatus_user_unique'))
@@ -1,21 +1,26 @@
-from datetime import datetime
+from datetime import timedelta
+
+from django.conf import settings
 from django.urls import reverse
-from django.db.models import Count
+from django.http import Http404
 from django.shortcuts import render, get_object_or_404, redirect
 from django.core.paginator import Paginator
 from django.utils.decorators import method_decorator
 from django.contrib.auth.decorators import login_required
 from django.views import View
-from django.contrib.postgres.search import SearchVector
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import Count, Exists, F, Max, OuterRef, Subquery
 from django.db.models.query import Q
 from django.contrib import messages
-from django.db.models import Avg
+from django.db import transaction
+from django.utils import timezone
 
 from components.users.decorators import admin_required
 from .models import (
     Book, BookReadStatus, BookRequestBuy,
-    BookReview, BookCategory
+    BookComment
 )
+from .cache import get_book, get_book_list_version, get_categories, invalidate_books
 from .forms import (
     BookCreateForm, BookUpdateForm,
     BookMarkReadForm, BookFavoriteForm,
@@ -23,101 +28,142 @@ from .forms import (
     BookReviewCreateForm, SearchBookForm, BookRatingCreateForm
 )
 from utility.log_activity import ActivityLog
+from utility.conditional import ConditionalGetMixin
+from utility.pagination import ListPaginationMixin
+from utility.replica import current_replica
 
 logger = ActivityLog()
 
 
-class BookListView(View):
+def is_recent(moment, seconds):
+    return bool(seconds) and timezone.now() - moment < timedelta(seconds=seconds)
+
+
+class BookListView(ConditionalGetMixin, ListPaginationMixin, View):
     template_name = 'book_list.html'
+    replica_reads = True
     paginate_by = 25
 
     @method_decorator(login_required)
     def get(self, request, *args, **kwargs):
         query = Q(is_activate=True)
 
-        books_favorite = []
-        if request.GET.get('favorited') == 'true':
-            books_favorite_qs = BookReadStatus.objects.filter(user=request.user,
-                                                              is_favorite=True).values_list('book_id', flat=True)
-            books_favorite.extend(list(books_favorite_qs))
-
-        if request.GET.get('reading') == 'true':
-            books_favorite_qs = BookReadStatus.objects.filter(user=request.user,
-                                                              status=BookReadStatus.STATUS_CHOICES[1][0]
-                                                              ).values_list('book_id', flat=True)
-            books_favorite.extend(list(books_favorite_qs))
-
-        if request.GET.get('read') == 'true':
-            books_favorite_qs = BookReadStatus.objects.filter(user=request.user,
-                                                              status=BookReadStatus.STATUS_CHOICES[2][0]
-                                                              ).values_list('book_id', flat=True)
-            books_favorite.extend(list(books_favorite_qs))
-
-        if request.GET.get('favorited') == 'true' or request.GET.get('reading') == 'true' or request.GET.get(
-                'read') == 'true':
-            query = query & Q(id__in=list(set(books_favorite)))
-
         category = request.GET.get('category')
         if category:
             query = query & Q(book_category__name=category)
 
-        books = Book.objects.filter(query).order_by('-updated_at')
-        paginator = Paginator(books, self.paginate_by)
-
-        page_number = request.GET.get('page')
-        page_obj = paginator.get_page(page_number)
-        return render(request, self.template_name, {'books': page_obj})
-
-
-class BookDetailView(View):
+        shelf_query = Q()
+        if request.GET.get('favorited') == 'true':
+            shelf_query = shelf_query | Q(is_favorite=True)
+        if request.GET.get('reading') == 'true':
+            shelf_query = shelf_query | Q(status=BookReadStatus.STATUS_CHOICES[1][0])
+        if request.GET.get('read') == 'true':
+            shelf_query = shelf_query | Q(status=BookReadStatus.STATUS_CHOICES[2][0])
+
+        user_status_qs = BookReadStatus.objects.filter(book=OuterRef('pk'), user=request.user)
+        books = Book.objects.filter(query)
+        if shelf_query:
+            books = books.filter(Exists(user_status_qs.filter(shelf_query)))
+
+        # Every change of the listed rows goes through invalidate_books or invalidate_categories,
+        # which move the list version, so the validators cost no query on the filtered set
+        last_updated = get_book_list_version()
+        etag = self.get_etag(request, last_updated, [(category.pk, category.name) for category in get_categories()])
+        response = self.not_modified(request, etag)
+        if response is not None:
+            return response
+
+        books = books.annotate(
+            user_status=Subquery(user_status_qs.values('status')[:1]),
+            user_is_favorite=Subquery(user_status_qs.values('is_favorite')[:1])
+        ).prefetch_related('book_category')
+        response = render(request, self.template_name, self.paginate(request, books, 'books'))
+        if current_replica() and is_recent(last_updated, settings.READ_REPLICAS.get('STICKY_SECONDS')):
+            # The replica may not have received the last change yet, do not tie this page to its version
+            return response
+        return self.set_validators(request, response, etag, last_updated)
+
+
+class BookDetailView(ConditionalGetMixin, View):
     template_name = 'book_detail.html'
+    replica_reads = True
+    comments_paginate_by = 20
 
     @method_decorator(login_required)
     def get(self, request, *args, **kwargs):
         book_id = kwargs.get('id')
-        book = get_object_or_404(Book, pk=book_id)
-
-        book_read_status_qs = BookReadStatus.objects.filter(book=book)
-        book_reviews_qs = BookReview.objects.filter(book_id=book_id).first()
-        rating = book_read_status_qs.aggregate(Avg('rating'))
-        rating = round(rating['rating__avg']) if rating['rating__avg'] else 0
+        book = get_book(book_id)
+        if book is None:
+            raise Http404('No Book matches the given query.')
+
+        status = BookReadStatus.objects.filter(book=book, user=request.user).first()
+        comments_qs = BookComment.objects.filter(book=book).select_related('user').order_by('-created_at', '-id')
+        # Comments show their author's username and avatar, a profile change has to revalidate the page
+        comments_state = BookComment.objects.filter(book=book).aggregate(
+            last_id=Max('id'), count=Count('id'), last_user_update=Max('user__updated_at')
+        )
+        etag = self.get_etag(
+            request, book.pk, book.updated_at, book.rating_sum, book.rating_count,
+            [(category.pk, category.name) for category in book.book_category.all()],
+            status and (status.pk, status.updated_at),
+            comments_state['last_id'], comments_state['count'], comments_state['last_user_update']
+        )
+        response = self.not_modified(request, etag)
+        if response is not None:
+            return response
+
+        paginator = Paginator(comments_qs, self.comments_paginate_by)
+        comments_page = paginator.get_page(request.GET.get('comments_page'))
         context = {
             'id': book_id,
             'book': book,
-            'rating': rating,
-            'status': book_read_status_qs.filter(user=request.user).first(),
-            'reviews': book_reviews_qs.messages if book_reviews_qs else [],
+            'rating': book.rating,
+            'status': status,
+            'reviews': comments_page,
             'form_comment': kwargs.get('form_comment'),
             'form_bookmark': kwargs.get('form_bookmark'),
             'form_favorite': kwargs.get('form_favorite'),
             'form_rating': kwargs.get('form_rating')
         }
-        return render(request, self.template_name, context)
+        response = render(request, self.template_name, context)
+        last_modified = max(book.updated_at, status.updated_at) if status else book.updated_at
+        return self.set_validators(request, response, etag, last_modified)
 
 
 class BookCategoryView(View):
     template_name = 'book_category.html'
+    replica_reads = True
 
     def get(self, request, *args, **kwargs):
-        book_categories = BookCategory.objects.annotate(num_book=Count('book')).order_by('name')
-        return render(request, self.template_name, {'categories': list(book_categories)})
+        return render(request, self.template_name, {'categories': get_categories()})
 
 
 class BookSearchView(View):
     template_name = 'book_list.html'
+    replica_reads = True
     form_class = SearchBookForm
+    paginate_by = 25
+
+    @method_decorator(login_required)
+    def get(self, request, *args, **kwargs):
+        return self.search(request, self.form_class(request.GET))
 
     @method_decorator(login_required)
     def post(self, request, *args, **kwargs):
-        search_form = self.form_class(request.POST)
+        return self.search(request, self.form_class(request.POST))
+
+    def search(self, request, search_form):
         if search_form.is_valid():
             search_text = search_form.cleaned_data['q']
-            books_qs = Book.objects.annotate(
-                search=SearchVector(
-                    'name', 'description', 'book_category__name'
-                )
-            ).filter(search=search_text).distinct('name')
-            return render(request, self.template_name, {'books': books_qs, 'q': search_text})
+            search_query = SearchQuery(search_text)
+            books_qs = Book.objects.filter(search_vector=search_query).annotate(
+                rank=SearchRank(F('search_vector'), search_query)
+            ).prefetch_related('book_category').order_by('-rank', '-updated_at')
+            paginator = Paginator(books_qs, self.paginate_by)
+
+            page_number = request.GET.get('page')
+            page_obj = paginator.get_page(page_number)
+            return render(request, self.template_name, {'books': page_obj, 'q': search_text})
         return redirect(reverse('book:book-list'))
 
 
@@ -127,7 +173,7 @@ class BookCreateView(View):
 
     @method_decorator(admin_required)
     def get(self, request, *args, **kwargs):
-        categories = BookCategory.objects.all()
+        categories = get_categories()
         context = {
             'categories': categories,
             'form': self.form_class
@@ -150,7 +196,7 @@ class BookUpdateView(View):
     @method_decorator(admin_required)
     def get(self, request, *args, **kwargs):
         book_id = kwargs.get('id')
-        categories = BookCategory.objects.all()
+        categories = get_categories()
         book = Book.objects.filter(id=book_id).first()
         if not book:
             return render(request, '404.html', {'message': 'Book not found'})
@@ -183,6 +229,7 @@ class BookDeleteView(View):
     def post(self, request, *args, **kwargs):
         book_id = kwargs.get('id')
         Book.objects.filter(id=book_id).update(is_activate=False)
+        invalidate_books([book_id])
         return redirect(reverse('book:book-list'))
 
 
@@ -196,30 +243,31 @@ class BookMarkReadView(BookDetailView):
         mark_read_form = self.form_class(request.POST)
         if mark_read_form.is_valid():
             page_reading = mark_read_form.cleaned_data['page_reading']
-            book_read_status_qs = BookReadStatus.objects.filter(
-                user=request.user,
-                book=book
-            ).first()
-            if book_read_status_qs and page_reading == book.paperback:
-                book_read_status_qs.page_reading = page_reading
-                book_read_status_qs.status = BookReadStatus.STATUS_CHOICES[2][0]
-                book_read_status_qs.save()
-                logger.log_activity(source_user=request.user, obj_target=book, activity=logger.READ)
-            elif book_read_status_qs and page_reading < book.paperback:
-                book_read_status_qs.page_reading = page_reading
-                book_read_status_qs.status = BookReadStatus.STATUS_CHOICES[1][0]
-                book_read_status_qs.save()
-                logger.log_activity(source_user=request.user, obj_target=book,
-                                    activity=f'{logger.READING}-{page_reading}')
-            elif not book_read_status_qs:
-                book_read_status_qs = BookReadStatus.objects.create(
-                    book=book,
-                    status=BookReadStatus.STATUS_CHOICES[1][0],
-                    page_reading=page_reading,
+            with transaction.atomic():
+                book_read_status_qs, created = BookReadStatus.objects.select_for_update().get_or_create(
+                    user=request.user,
+                    book=book
                 )
-                book_read_status_qs.user.add(request.user)
-                logger.log_activity(source_user=request.user, obj_target=book,
-                                    activity=f'{logger.READING}-{page_reading} page')
+                stats_before = None if created else book_read_status_qs.stats()
+                if created:
+                    book_read_status_qs.page_reading = page_reading
+                    book_read_status_qs.status = BookReadStatus.STATUS_CHOICES[1][0]
+                    activity = f'{logger.READING}-{page_reading} page'
+                elif page_reading == book.paperback:
+                    book_read_status_qs.page_reading = page_reading
+                    book_read_status_qs.status = BookReadStatus.STATUS_CHOICES[2][0]
+                    activity = logger.READ
+                elif page_reading < book.paperback:
+                    book_read_status_qs.page_reading = page_reading
+                    book_read_status_qs.status = BookReadStatus.STATUS_CHOICES[1][0]
+                    activity = f'{logger.READING}-{page_reading}'
+                else:
+                    activity = None
+                if activity:
+                    book_read_status_qs.save()
+                    Book.objects.filter(pk=book.pk).add_read_status_stats(stats_before, book_read_status_qs.stats())
+            if activity:
+                logger.log_activity(source_user=request.user, obj_target=book, activity=activity)
 
             return redirect(reverse('book:book-detail', kwargs={'id': kwargs.get('id')}))
         kwargs.update({'form_bookmark': mark_read_form})
@@ -236,21 +284,15 @@ class BookFavoriteView(BookDetailView):
         favorite_form = self.form_class(request.POST)
         if favorite_form.is_valid():
             is_favorite = favorite_form.cleaned_data['is_favorite']
-            book_read_status_qs = BookReadStatus.objects.filter(
-                user=request.user,
-                book=book
-            ).first()
-            if book_read_status_qs:
-                book_read_status_qs.is_favorite = is_favorite
-                book_read_status_qs.save()
-            else:
-                book_read_status_qs = BookReadStatus.objects.create(
-                    book=book,
-                    is_favorite=True,
-                    status=BookReadStatus.STATUS_CHOICES[0][0]
+            with transaction.atomic():
+                book_read_status_qs, created = BookReadStatus.objects.select_for_update().get_or_create(
+                    user=request.user,
+                    book=book
                 )
-                book_read_status_qs.user.add(request.user)
+                stats_before = None if created else book_read_status_qs.stats()
+                book_read_status_qs.is_favorite = is_favorite
                 book_read_status_qs.save()
+                Book.objects.filter(pk=book.pk).add_read_status_stats(stats_before, book_read_status_qs.stats())
             logger.log_activity(source_user=request.user, obj_target=book,
                                 activity=logger.FAVORITE_MSG if is_favorite else logger.UNFAVORITE_MSG)
             return redirect(reverse('book:book-detail', kwargs={'id': kwargs.get('id')}))
@@ -268,34 +310,14 @@ class BookReviewCreateView(BookDetailView):
 
         book_review_form = self.form_class(request.POST)
         if book_review_form.is_valid():
-            book = Book.objects.get(id=book_id)
-            book_review_qs = BookReview.objects.filter(book=book).first()
-
-            now = datetime.now()
-            if book_review_qs:
-                book_messages_review = book_review_qs.messages
-                book_messages_review.append(
-                    [request.user.username,
-                     book_review_form.cleaned_data['message'],
-                     now.strftime("%m/%d/%Y, %H:%M:%S"),
-                     str(request.user.id),
-                     str(request.user.avatar.name)]
-                )
-                book_review_qs.messages = book_messages_review
-                book_review_qs.save()
-            else:
-                book_review_qs = BookReview.objects.create(
-                    book=book,
-                    messages=[
-                        [request.user.username,
-                         book_review_form.cleaned_data['message'],
-                         now.strftime("%m/%d/%Y, %H:%M:%S"),
-                         str(request.user.id),
-                         str(request.user.avatar.name)
-                         ]]
-                )
-            logger.log_activity(source_user=request.user, obj_target=book_review_qs, activity=logger.COMMENT,
-                                option_content=book_review_form.cleaned_data['message'])
+            book = get_object_or_404(Book, pk=book_id)
+            comment = BookComment.objects.create(
+                book=book,
+                user=request.user,
+                body=book_review_form.cleaned_data['message']
+            )
+            logger.log_activity(source_user=request.user, obj_target=comment, activity=logger.COMMENT,
+                                option_content=comment.body)
             return redirect(reverse('book:book-detail', kwargs={'id': book_id}))
         kwargs.update({'form_comment': book_review_form})
         response = self.get(request, **kwargs)
@@ -307,48 +329,44 @@ class BookRatingCreateView(BookDetailView):
 
     @method_decorator(login_required)
     def post(self, request, *args, **kwargs):
+        book = get_object_or_404(Book, pk=kwargs.get('id'))
         rating_form = self.form_class(request.POST)
         if rating_form.is_valid():
-            book_read_status_qs = BookReadStatus.objects.filter(book__id=kwargs.get('id')).first()
-            if book_read_status_qs:
-                book_read_status_qs.rating = rating_form.cleaned_data['rating']
-                book_read_status_qs.save()
-            else:
-                book_read_status_qs = BookReadStatus.objects.create(
-                    book__id=kwargs.get('id'),
-                    rating=rating_form.cleaned_data['rating']
+            with transaction.atomic():
+                book_read_status_qs, created = BookReadStatus.objects.select_for_update().get_or_create(
+                    user=request.user,
+                    book=book
                 )
-                book_read_status_qs.user.add(request.user)
+                stats_before = None if created else book_read_status_qs.stats()
+                book_read_status_qs.rating = rating_form.cleaned_data['rating']
                 book_read_status_qs.save()
+                Book.objects.filter(pk=book.pk).add_read_status_stats(stats_before, book_read_status_qs.stats())
             return redirect(reverse('book:book-detail', kwargs={'id': kwargs.get('id')}))
         kwargs.update({'form_rating': rating_form})
         response = self.get(request, **kwargs)
         return response
 
 
-class BookRequestBuyListView(View):
+class BookRequestBuyListView(ListPaginationMixin, View):
     template_name = 'book_list_request_buy.html'
     paginate_by = 25
 
     @method_decorator(login_required)
     def get(self, request, *args, **kwargs):
-        books_requests_buy_qs = BookRequestBuy.objects.filter(is_activate=True).order_by('-updated_at')
-        categories = BookCategory.objects.all()
+        books_requests_buy_qs = BookRequestBuy.objects.filter(is_activate=True).select_related(
+            'user').prefetch_related('book_category')
+        categories = get_categories()
 
-        paginator = Paginator(books_requests_buy_qs, self.paginate_by)
-        page_number = request.GET.get('page')
-        page_obj = paginator.get_page(page_number)
         context = {
             'form_to_buy_book': kwargs.get('form_to_buy_book'),
             'form_update_request': kwargs.get('form_update_request'),
-            'books_requests_buy': page_obj,
             'categories': categories
         }
+        context.update(self.paginate(request, books_requests_buy_qs, 'books_requests_buy'))
         return render(request, self.template_name, context)
 
 
 class BookRequestBuyCreateView(BookRequestBuyListView):
-    template_name = 'book_create_request_buy.html'
     form_class = BookRequestBuyForm
 
     @method_decorator(login_required)
@@ -0,0 +1,93 @@
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from utility.process import ProcessLocal
+from .models import User
+
+log = logging.getLogger(__name__)
+
+# Under uWSGI the thread only runs with enable-threads, see uwsgi.ini
+_executors = ProcessLocal(lambda: ThreadPoolExecutor(max_workers=1, thread_name_prefix='avatar-thumbnails'))
+
+
+def avatar_thumbnail_path(user_id, digest, size):
+    return f'user_{user_id}/avatar/thumbnails/{digest}-{size}.jpg'
+
+
+def render_avatar_thumbnails(user):
+    """Write the square JPEG thumbnails of the avatar of a user, return the avatar_thumbnails mapping.
+
+    Names hash the avatar content, an existing thumbnail is never rewritten so it can be cached forever.
+    """
+    storage = user.avatar.storage
+    with user.avatar.open('rb') as avatar_file:
+        data = avatar_file.read()
+    digest = hashlib.sha1(data).hexdigest()[:16]
+    sizes = settings.AVATAR['THUMBNAIL_SIZES']
+
+    image = None
+    thumbnails = {'source': user.avatar.name}
+    for name, size in sizes.items():
+        path = avatar_thumbnail_path(user.id, digest, size)
+        if not storage.exists(path):
+            if image is None:
+                image = Image.open(BytesIO(data))
+                # Let the JPEG decoder downscale while reading, thumbnails never need the full resolution
+                image.draft('RGB', (max(sizes.values()),) * 2)
+                image = ImageOps.exif_transpose(image)
+                if image.mode in ('RGBA', 'LA', 'P'):
+                    # JPEG has no alpha channel, flatten transparent avatars on white
+                    image = image.convert('RGBA')
+                    background = Image.new('RGB', image.size, 'white')
+                    background.paste(image, mask=image.getchannel('A'))
+                    image = background
+                image = image.convert('RGB')
+            thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+            output = BytesIO()
+            thumbnail.save(output, 'JPEG', quality=settings.AVATAR['THUMBNAIL_QUALITY'], optimize=True,
+                           progressive=True)
+            storage.save(path, ContentFile(output.getvalue()))
+        thumbnails[name] = path
+    return thumbnails
+
+
+def generate_avatar_thumbnails(user_id):
+    """Generate and record the thumbnails of the current avatar of a user, None when there is no avatar."""
+    user = User.objects.filter(pk=user_id).only('id', 'avatar').first()
+    if user is None or not user.avatar:
+        return None
+    thumbnails = render_avatar_thumbnails(user)
+    # The avatar may have been replaced meanwhile, its own job records its thumbnails
+    User.objects.filter(pk=user_id, avatar=user.avatar.name).update(avatar_thumbnails=thumbnails,
+                                                                    updated_at=timezone.now())
+    return thumbnails
+
+
+def _generate_in_background(user_id):
+    try:
+        generate_avatar_thumbnails(user_id)
+    except Exception:
+        log.exception('Could not generate the avatar thumbnails of user %s', user_id)
+    finally:
+        connection.close()
+
+
+def get_avatar_executor():
+    """Return the thread pool generating thumbnails for the current (forked) process."""
+    return _executors.get()
+
+
+def schedule_avatar_thumbnails(user_id):
+    """Generate the avatar thumbnails of a user once the current transaction commits."""
+    if not settings.AVATAR['ASYNC']:
+        generate_avatar_thumbnails(user_id)
+        return
+    transaction.on_commit(lambda: get_avatar_executor().submit(_generate_in_background, user_id))
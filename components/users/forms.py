@@ -1,5 +1,6 @@
 import datetime
 from django import forms
+from django.conf import settings
 from django.contrib.auth.forms import UserCreationForm
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
@@ -70,10 +71,19 @@ class ChangeRoleAccountForm(forms.Form):
 
 
 class UserUpdateForm(forms.ModelForm):
+    avatar = forms.ImageField(required=False)
+
     class Meta:
         model = User
         fields = ['username', 'education', 'location', 'skills', 'notes']
 
+    def clean_avatar(self):
+        avatar = self.cleaned_data['avatar']
+        max_size = settings.AVATAR['MAX_UPLOAD_SIZE']
+        if avatar and avatar.size > max_size:
+            raise ValidationError(f'This image is larger than {max_size // (1024 * 1024)} MB')
+        return avatar
+
 
 class UserFollowForm(forms.Form):
     following_id = forms.IntegerField()
@@ -0,0 +1,213 @@
+import json
+import math
+import platform
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+from importlib import import_module
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+
+from components.books.models import Book
+from components.users.models import User
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def percentile(values, percent):
+    """Nearest rank percentile of sorted values."""
+    if not values:
+        return 0.0
+    return values[max(math.ceil(len(values) * percent / 100), 1) - 1]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    summary = {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'throughput': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'mean': round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        'max': round(latencies[-1], 2) if latencies else 0.0,
+    }
+    summary.update({f'p{percent}': round(percentile(latencies, percent), 2) for percent in PERCENTILES})
+    return summary
+
+
+class Command(BaseCommand):
+    help = 'Measure the throughput and latency percentiles of the main pages, saved as JSON to compare runs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('pages', nargs='*', help='Pages to measure (book-list, book-search, book-detail, '
+                                                     'user-detail, dashboard), all of them by default')
+        parser.add_argument('--mode', default='client', choices=['client', 'http'],
+                            help='Django test client in process, or HTTP requests to --base-url (a running server)')
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--requests', type=int, default=200, help='Measured requests per page')
+        parser.add_argument('--warmup', type=int, default=10, help='Requests per page sent before measuring')
+        parser.add_argument('--concurrency', type=int, default=1, help='Threads sending requests')
+        parser.add_argument('--email', help='User to sign in as, must be an admin to measure the dashboard')
+        parser.add_argument('--search', default='garden', help='Search query of book-search')
+        parser.add_argument('--output', help='JSON file to write the results to')
+        parser.add_argument('--compare', help='JSON file of a previous run to print the differences with')
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['email'])
+        pages = self.get_pages(options['search'])
+        names = options['pages'] or list(pages)
+        unknown = set(names) - set(pages)
+        if unknown:
+            raise CommandError(f"Unknown pages {', '.join(sorted(unknown))}, choose among {', '.join(pages)}")
+        if settings.DEBUG and options['mode'] == 'client':
+            self.stderr.write('DEBUG is on, queries are logged and kept in memory: latencies are pessimistic')
+
+        session_key = self.create_session(user)
+        results = {}
+        for name in names:
+            url = pages[name]
+            self.run(url, options['warmup'], options['concurrency'], session_key, options)
+            results[name] = dict(url=url, **self.run(url, options['requests'], options['concurrency'],
+                                                     session_key, options))
+            self.stdout.write(self.format_row(name, results[name]))
+
+        report = {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'commit': self.git_commit(),
+            'python': platform.python_version(),
+            'mode': options['mode'],
+            'concurrency': options['concurrency'],
+            'user': user.email,
+            'dataset': {'books': Book.objects.count(), 'users': User.objects.count()},
+            'pages': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+        if options['compare']:
+            self.compare(options['compare'], report)
+
+    def get_user(self, email):
+        users = User.objects.filter(is_activate=True)
+        user = users.filter(email=email).first() if email else \
+            users.filter(role=User.ROLE_ADMIN).order_by('pk').first()
+        if user is None:
+            raise CommandError(f'No active user {email or "admin"}, seed one with the seed_synthetic_data command')
+        return user
+
+    def get_pages(self, search):
+        """URLs of the measured pages, detail pages show the busiest book and user."""
+        book = Book.objects.filter(is_activate=True).order_by('-reader_count', 'pk').only('pk').first()
+        member = User.objects.filter(is_activate=True).order_by('-follower_count', 'pk').only('pk').first()
+        pages = {
+            'book-list': reverse('book:book-list'),
+            'book-search': f"{reverse('book:book-search')}?{urlencode({'q': search})}",
+            'book-detail': reverse('book:book-detail', kwargs={'id': book.pk}) if book else None,
+            'user-detail': reverse('users:user-detail', kwargs={'id': member.pk}),
+            'dashboard': reverse('users:dashboard'),
+        }
+        return {name: url for name, url in pages.items() if url}
+
+    def create_session(self, user):
+        # What login() stores, without a sign in request (and its password hashing) per client
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+        return session.session_key
+
+    def run(self, url, count, concurrency, session_key, options):
+        """Send count requests to url from concurrency threads, return the latency summary in ms."""
+        latencies = []
+        errors = []
+        counter = iter(range(count))
+        lock = threading.Lock()
+
+        def worker():
+            send = self.client_sender(session_key) if options['mode'] == 'client' else \
+                self.http_sender(options['base_url'], session_key)
+            while True:
+                with lock:
+                    if next(counter, None) is None:
+                        return
+                start = time.perf_counter()
+                ok = send(url)
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    (latencies if ok else errors).append(elapsed)
+
+        def thread_worker():
+            try:
+                worker()
+            finally:
+                # Each thread opened its own database connections
+                connections.close_all()
+
+        start = time.perf_counter()
+        if concurrency > 1:
+            threads = [threading.Thread(target=thread_worker) for _ in range(concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        else:
+            worker()
+        return summarize(latencies, len(errors), time.perf_counter() - start)
+
+    def client_sender(self, session_key):
+        # A page raising counts as an error instead of stopping the run
+        client = Client(raise_request_exception=False)
+        client.cookies[settings.SESSION_COOKIE_NAME] = session_key
+
+        def send(url):
+            return client.get(url).status_code == 200
+        return send
+
+    def http_sender(self, base_url, session_key):
+        cookie = f'{settings.SESSION_COOKIE_NAME}={session_key}'
+
+        def send(url):
+            request = urllib.request.Request(base_url.rstrip('/') + url, headers={'Cookie': cookie})
+            try:
+                with urllib.request.urlopen(request, timeout=30) as response:
+                    response.read()
+                    # Redirects are followed, the sign in page means the session was refused
+                    return response.status == 200 and response.url.endswith(url)
+            except (urllib.error.URLError, OSError):
+                return False
+        return send
+
+    def git_commit(self):
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def format_row(self, name, result):
+        return (f"{name:<14}{result['requests']:>8}{result['errors']:>7}{result['throughput']:>10.1f} req/s"
+                + ''.join(f"{'p' + str(percent):>6}{result[f'p{percent}']:>9.1f}" for percent in PERCENTILES)
+                + ' ms')
+
+    def compare(self, path, report):
+        with open(path) as previous_file:
+            previous = json.load(previous_file)
+        self.stdout.write(f"Compared with {path} ({previous.get('commit')}, {previous.get('created_at')})")
+        for name, result in report['pages'].items():
+            before = previous['pages'].get(name)
+            if not before:
+                continue
+            changes = [(metric, before[metric], result[metric]) for metric in ['throughput', 'p50', 'p95', 'p99']]
+            self.stdout.write(f'{name:<14}' + ''.join(
+                f'{metric:>12} {old:.1f} -> {new:.1f} ({(new - old) / old * 100 if old else 0:+.0f}%)'
+                for metric, old, new in changes))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from utility.log_activity import ActivityLog
+
+
+class Command(BaseCommand):
+    help = 'Create the indexes used to read the Mongo activity log'
+
+    def handle(self, *args, **options):
+        ActivityLog().ensure_indexes()
+        for _, name in ActivityLog.INDEXES:
+            self.stdout.write(self.style.SUCCESS(f'Index {name} is ready'))
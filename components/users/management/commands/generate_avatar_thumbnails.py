@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from components.users.avatars import generate_avatar_thumbnails
+from components.users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Generate the thumbnails of existing user avatars in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate users that already have thumbnails (e.g. after changing the sizes)')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        users = User.objects.exclude(avatar='').exclude(avatar__isnull=True)
+        if not options['force']:
+            users = users.filter(avatar_thumbnails={})
+        last_id = 0
+        total = 0
+        failed = 0
+        while True:
+            user_ids = list(users.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not user_ids:
+                break
+            for user_id in user_ids:
+                try:
+                    generate_avatar_thumbnails(user_id)
+                    total += 1
+                except (OSError, ValueError) as e:
+                    failed += 1
+                    self.stderr.write(f'User {user_id}: {e}')
+            last_id = user_ids[-1]
+            self.stdout.write(f'Generated thumbnails for {total} users (last id {last_id})')
+
+        self.stdout.write(self.style.SUCCESS(f'Avatar thumbnails generated for {total} users, {failed} failed'))
@@ -0,0 +1,50 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from utility.perf import load_perf_events, load_perf_histograms
+
+
+class Command(BaseCommand):
+    help = 'Print the per view request costs recorded by PerformanceMiddleware in every process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sink-dir', default=settings.PERF.get('SINK_DIR'))
+        parser.add_argument('--sort', default='total', choices=['total', 'db', 'queries', 'mongo', 'template', 'count'],
+                            help='Order views by the p95 of this metric or by request count')
+
+    def handle(self, *args, **options):
+        views = load_perf_histograms(options['sink_dir'])
+        events = load_perf_events(options['sink_dir'])
+        if not views and not events:
+            self.stdout.write(f"No request recorded in {options['sink_dir']}")
+            return
+        if views:
+            self.write_views(views, options['sort'])
+        if events:
+            self.write_events(events)
+
+    def write_views(self, views, sort):
+        rows = sorted(views.items(), reverse=True, key=lambda item: (
+            item[1]['total'].count if sort == 'count' else item[1][sort].percentile(95)))
+        self.stdout.write(f"{'view':<32}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+                          f"{'db p95':>10}{'queries':>9}{'mongo p95':>11}{'tpl p95':>10}")
+        for view_name, histograms in rows:
+            total = histograms['total']
+            self.stdout.write(
+                f'{view_name:<32}{total.count:>8}{total.percentile(50):>10.1f}{total.percentile(95):>10.1f}'
+                f"{total.percentile(99):>10.1f}{histograms['db'].percentile(95):>10.1f}"
+                f"{histograms['queries'].mean():>9.1f}{histograms['mongo'].percentile(95):>11.1f}"
+                f"{histograms['template'].percentile(95):>10.1f}"
+            )
+
+    def write_events(self, events):
+        """Per minute counts of the events, e.g. db.default.opened for the database connections opened."""
+        current_minute = int(time.time() // 60)
+        self.stdout.write(f"{'event':<32}{'last min':>10}{'10 min avg':>12}{'60 min':>8}")
+        for name, counts in sorted(events.items()):
+            last_ten = sum(counts.get(current_minute - offset, 0) for offset in range(1, 11))
+            last_hour = sum(count for minute, count in counts.items() if minute > current_minute - 60)
+            self.stdout.write(f'{name:<32}{counts.get(current_minute - 1, 0):>10}{last_ten / 10:>12.1f}'
+                              f'{last_hour:>8}')
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from components.users.models import User, UserFollow
+
+
+class Command(BaseCommand):
+    help = 'Recompute the follower and following counts stored on users in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        total = 0
+        while True:
+            user_ids = list(User.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)
+                            [:batch_size])
+            if not user_ids:
+                break
+            with transaction.atomic():
+                total += UserFollow.rebuild_follow_counts(User.objects.filter(pk__in=user_ids))
+            last_id = user_ids[-1]
+            self.stdout.write(f'Rebuilt {total} users (last id {last_id})')
+
+        self.stdout.write(self.style.SUCCESS(f'Follow counts rebuilt for {total} users'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from components.users.stats import refresh_dashboard_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the admin dashboard statistics and store them in the cache'
+
+    def handle(self, *args, **options):
+        stats = refresh_dashboard_stats()
+        self.stdout.write(self.style.SUCCESS(f"Dashboard statistics computed at {stats['computed_at']}"))
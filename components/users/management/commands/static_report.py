@@ -0,0 +1,78 @@
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.management.base import BaseCommand
+from django.template import engines
+from django.template.utils import get_app_template_dirs
+
+from utility.storage import COMPRESSIBLE_EXTENSIONS, brotli, compress
+
+STATIC_RE = re.compile(r'''{%\s*static\s+['"]([^'"]+)['"]''')
+TEMPLATE_RE = re.compile(r'''{%\s*(?:extends|include)\s+['"]([^'"]+)['"]''')
+
+
+class Command(BaseCommand):
+    help = 'Report the static bytes each page template links, as stored and with the precompressed variants'
+
+    def add_arguments(self, parser):
+        parser.add_argument('templates', nargs='*', help='Template names, every page template by default')
+
+    def handle(self, *args, **options):
+        self.engine = engines['django'].engine
+        self.asset_sizes = {}
+        names = options['templates'] or self.page_templates()
+
+        columns = ['before', 'gzip'] + (['brotli'] if brotli else [])
+        self.stdout.write(f"{'template':<32}{'assets':>8}" + ''.join(f'{column:>12}' for column in columns))
+        for name in names:
+            assets = self.static_assets(name)
+            sizes = [self.asset_size(path) for path in assets]
+            totals = [sum(size.get(column, 0) for size in sizes) for column in columns]
+            self.stdout.write(f'{name:<32}{len(assets):>8}' + ''.join(f'{total:>12,}' for total in totals))
+        if not brotli:
+            self.stdout.write('Install the brotli package to report (and collect) brotli variants')
+
+    def page_templates(self):
+        names = set()
+        directories = list(self.engine.dirs) + list(get_app_template_dirs('templates'))
+        # Pages of this project only, not the templates shipped with Django and third party apps
+        for directory in [directory for directory in directories if directory.startswith(settings.BASE_DIR)]:
+            for root, dirs, files in os.walk(directory):
+                for filename in files:
+                    name = os.path.relpath(os.path.join(root, filename), directory).replace(os.sep, '/')
+                    if filename.endswith('.html') and not name.startswith('includes/'):
+                        names.add(name)
+        return sorted(names)
+
+    def static_assets(self, name, seen=None):
+        """Static paths linked by a template and the templates it extends or includes."""
+        seen = seen if seen is not None else set()
+        if name in seen:
+            return []
+        seen.add(name)
+        source = self.engine.get_template(name).source
+        assets = STATIC_RE.findall(source)
+        for parent in TEMPLATE_RE.findall(source):
+            if parent.startswith(('./', '../')):
+                parent = posixpath.normpath(posixpath.join(posixpath.dirname(name), parent))
+            assets += self.static_assets(parent, seen)
+        return list(dict.fromkeys(assets))
+
+    def asset_size(self, path):
+        if path not in self.asset_sizes:
+            found = finders.find(path)
+            if not found:
+                self.stderr.write(f'Missing static file {path}')
+                self.asset_sizes[path] = {}
+            else:
+                with open(found, 'rb') as asset:
+                    content = asset.read()
+                size = {'before': len(content)}
+                variants = dict(compress(content)) if path.endswith(COMPRESSIBLE_EXTENSIONS) else {}
+                size['gzip'] = len(variants.get('.gz', content))
+                size['brotli'] = len(variants.get('.br', content))
+                self.asset_sizes[path] = size
+        return self.asset_sizes[path]
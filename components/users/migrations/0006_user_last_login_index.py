@@ -0,0 +1,17 @@
+# Generated by Django 3.0.5 on 2026-10-18 17:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_auto_20200417_0815'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['is_activate', '-last_login'], name='user_is_acti_18d45c_idx'),
+        ),
+    ]
@@ -1,7 +1,10 @@
 from django.contrib.auth.base_user import AbstractBaseUser
 from django.contrib.auth.models import UserManager
+from django.contrib.postgres.fields import JSONField
 from django.utils.translation import gettext_lazy as _
 from django.db import models
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 
 
 def user_directory_path(instance, filename):
@@ -31,10 +34,15 @@ class User(AbstractBaseUser, UserBase):
     role = models.IntegerField(choices=USER_ROLES, default=ROLE_MEMBER)
     is_activate = models.BooleanField(default=False)
     avatar = models.ImageField(upload_to=user_directory_path, null=True)
+    # Avatar name as 'source' and size name -> storage path of its thumbnails, see components.users.avatars
+    avatar_thumbnails = JSONField(default=dict, editable=False)
     education = models.CharField(max_length=256, null=True)
     location = models.CharField(max_length=256, null=True)
     skills = models.CharField(max_length=256, null=True)
     notes = models.TextField(null=True)
+    # Maintained by UserFollow.set_status, rebuilt by the rebuild_follow_counts command
+    follower_count = models.IntegerField(default=0, editable=False)
+    following_count = models.IntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -45,10 +53,31 @@ class User(AbstractBaseUser, UserBase):
 
     class Meta:
         db_table = 'user'
+        indexes = [
+            models.Index(fields=['is_activate', '-last_login']),
+            models.Index(fields=['-follower_count']),
+        ]
 
     def __str__(self):
         return 'User: {}'.format(self.username)
 
+    def get_avatar_url(self, size):
+        """URL of the avatar thumbnail of this size, the original until the thumbnails are generated."""
+        if not self.avatar:
+            return None
+        thumbnails = self.avatar_thumbnails
+        if thumbnails.get('source') == self.avatar.name and size in thumbnails:
+            return self.avatar.storage.url(thumbnails[size])
+        return self.avatar.url
+
+    @property
+    def avatar_small_url(self):
+        return self.get_avatar_url('small')
+
+    @property
+    def avatar_large_url(self):
+        return self.get_avatar_url('large')
+
 
 class UserFollow(UserBase):
     STATUS_FOLLOW = (
@@ -65,3 +94,24 @@ class UserFollow(UserBase):
 
     def __str__(self):
         return f'{self.follower.username} follows {self.following.username}'
+
+    def set_status(self, status):
+        """Save a new status, moving the follow counts of both users when it flips."""
+        if status == self.status:
+            return False
+        self.status = status
+        self.save()
+        delta = 1 if status == self.STATUS_FOLLOW[1][0] else -1
+        User.objects.filter(pk=self.follower_id).update(following_count=F('following_count') + delta)
+        User.objects.filter(pk=self.following_id).update(follower_count=F('follower_count') + delta)
+        return True
+
+    @classmethod
+    def rebuild_follow_counts(cls, users):
+        """Recompute the stored follow counts of these users from UserFollow."""
+        def count(field):
+            follows = cls.objects.filter(status=cls.STATUS_FOLLOW[1][0], **{field: OuterRef('pk')})
+            follows = follows.order_by().values(field)
+            return Coalesce(Subquery(follows.annotate(value=Count('pk')).values('value')), Value(0))
+
+        return users.update(follower_count=count('following'), following_count=count('follower'))
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+
+from components.books.models import Book, BookRequestBuy, BookReadStatus
+from .models import User
+
+DASHBOARD_CACHE_KEY = 'dashboard:stats'
+
+
+def compute_dashboard_stats():
+    most_read_books = Book.objects.filter(reader_count__gt=0).order_by('-reader_count').values(
+        'id', 'name', 'author', 'reader_count')[:5]
+    most_followed_users = User.objects.filter(follower_count__gt=0).order_by('-follower_count').values(
+        'id', 'username', 'role', 'follower_count')[:5]
+    most_read_book_members = BookReadStatus.objects.filter(status__in=[1, 2]).values('user__id',
+                                                                                     'user__username',
+                                                                                     'user__role').annotate(
+        total=Count('user')).order_by('-total')[:5]
+    return {
+        'users_count': User.objects.all().count(),
+        'books_count': Book.objects.all().count(),
+        'books_request_buy_count': BookRequestBuy.objects.filter(status=BookRequestBuy.STATUS_CHOICES[0][0]).count(),
+        'most_read_books': list(most_read_books),
+        'most_followed_users': list(most_followed_users),
+        'most_read_book_members': list(most_read_book_members),
+        'computed_at': timezone.now()
+    }
+
+
+def refresh_dashboard_stats():
+    stats = compute_dashboard_stats()
+    cache.set(DASHBOARD_CACHE_KEY, stats, settings.DASHBOARD_CACHE_TIMEOUT)
+    return stats
+
+
+def get_dashboard_stats():
+    """Return the cached dashboard snapshot, computing it when missing or expired."""
+    stats = cache.get(DASHBOARD_CACHE_KEY)
+    if stats is None:
+        stats = refresh_dashboard_stats()
+    return stats
@@ -1,3 +1,534 @@
-from django.test import TestCase
+import base64
+import json
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+import pymongo
+from bson import ObjectId
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from PIL import Image
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from components.books.models import Book, BookComment, BookReadStatus
+from utility.log_activity import ActivityLog, ActivityLogWriter, timeline_cache_key, touch_activity_version
+from utility.process import ProcessLocal
+from utility.querycheck import QueryBudgetTestMixin
+from . import urls as user_urls
+from .models import User, UserFollow
+from .stats import DASHBOARD_CACHE_KEY
+
+
+def matches(document, query):
+    """Evaluate the subset of the Mongo query language ActivityLog uses against one document."""
+    for field, condition in query.items():
+        if field == '$and':
+            if not all(matches(document, subquery) for subquery in condition):
+                return False
+        elif field == '$or':
+            if not any(matches(document, subquery) for subquery in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = document.get(field)
+            if '$in' in condition and value not in condition['$in']:
+                return False
+            if '$lt' in condition and not value < condition['$lt']:
+                return False
+        elif document.get(field) != condition:
+            return False
+    return True
+
+
+class FakeCursor(object):
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, keys):
+        for field, direction in reversed(keys):
+            self.documents.sort(key=lambda document: document[field], reverse=direction == pymongo.DESCENDING)
+        return self
+
+    def limit(self, limit):
+        self.documents = self.documents[:limit]
+        return self
+
+    def __iter__(self):
+        return iter(self.documents)
+
+
+class FakeActivityCollection(object):
+    """In memory stand-in of the Mongo activity collection."""
+
+    def __init__(self, documents=()):
+        self.documents = list(documents)
+        self.find_count = 0
+        self.batches = []
+        self.inserted = threading.Condition()
+        # Cleared to hold insert_many until set again, inserting tells it was entered
+        self.release = threading.Event()
+        self.release.set()
+        self.inserting = threading.Event()
+
+    def insert_many(self, documents, ordered=True):
+        self.inserting.set()
+        self.release.wait()
+        with self.inserted:
+            self.batches.append(list(documents))
+            self.documents.extend(documents)
+            self.inserted.notify_all()
+
+    def wait_for_documents(self, count, timeout=5):
+        with self.inserted:
+            return self.inserted.wait_for(lambda: len(self.documents) >= count, timeout)
+
+    def insert_one(self, document):
+        document.setdefault('_id', ObjectId())
+        self.insert_many([document])
+
+    def find(self, query, projection=None):
+        self.find_count += 1
+        return FakeCursor([dict(document) for document in self.documents if matches(document, query)])
+
+    def create_index(self, keys, **options):
+        pass
+
+
+class ActivityLogWriterTest(SimpleTestCase):
+
+    def setUp(self):
+        self.collection = FakeActivityCollection()
+
+    def get_writer(self, **options):
+        writer = ActivityLogWriter(self.collection, **dict({'batch_size': 100, 'flush_interval': 60}, **options))
+        self.addCleanup(writer.stop)
+        return writer
+
+    def fill_queue(self, writer):
+        """Hold the writer thread inside insert_many with its queue full."""
+        self.collection.release.clear()
+        self.addCleanup(self.collection.release.set)
+        writer.write({'activity': 'held'})
+        self.assertTrue(self.collection.inserting.wait(5))
+        self.assertTrue(writer.write({'activity': 'queued'}))
+
+    def test_flush_on_batch_size(self):
+        writer = self.get_writer(batch_size=3)
+        for i in range(7):
+            writer.write({'activity': i})
+        self.assertTrue(self.collection.wait_for_documents(6))
+        self.assertEqual(self.collection.batches[:2], [[{'activity': i} for i in range(3)],
+                                                       [{'activity': i} for i in range(3, 6)]])
+
+    def test_flush_on_interval(self):
+        writer = self.get_writer(flush_interval=0.05)
+        writer.write({'activity': 0})
+        self.assertTrue(self.collection.wait_for_documents(1))
+        self.assertEqual(self.collection.batches, [[{'activity': 0}]])
+
+    def test_drop_when_full(self):
+        writer = self.get_writer(batch_size=1, queue_size=1, overflow=ActivityLogWriter.OVERFLOW_DROP)
+        self.fill_queue(writer)
+        # Space frees up soon, a dropping writer does not wait for it
+        threading.Timer(0.1, self.collection.release.set).start()
+        self.assertFalse(writer.write({'activity': 'dropped'}))
+        self.assertEqual(writer.stats()['dropped'], 1)
+
+    def test_block_when_full(self):
+        writer = self.get_writer(batch_size=1, queue_size=1, overflow=ActivityLogWriter.OVERFLOW_BLOCK,
+                                 block_timeout=5)
+        self.fill_queue(writer)
+        threading.Timer(0.1, self.collection.release.set).start()
+        self.assertTrue(writer.write({'activity': 'waited'}))
+        self.assertTrue(self.collection.wait_for_documents(3))
+
+        writer.block_timeout = 0.05
+        self.collection.inserting.clear()
+        self.fill_queue(writer)
+        self.assertFalse(writer.write({'activity': 'timed out'}))
+        self.assertEqual(writer.stats()['dropped'], 1)
+
+    def test_stop_flushes_pending_events(self):
+        writer = self.get_writer()
+        for i in range(5):
+            writer.write({'activity': i})
+        writer.stop()
+        self.assertEqual(self.collection.documents, [{'activity': i} for i in range(5)])
+        self.assertFalse(writer.write({'activity': 'late'}))
+
+    def test_stats(self):
+        writer = self.get_writer(batch_size=1, queue_size=1)
+        self.fill_queue(writer)
+        writer.write({'activity': 'dropped'})
+        self.assertEqual(writer.stats(), {'queued': 2, 'flushed': 0, 'dropped': 1, 'failed': 0, 'pending': 2})
+        self.collection.release.set()
+        writer.stop()
+        self.assertEqual(writer.stats(), {'queued': 2, 'flushed': 2, 'dropped': 1, 'failed': 0, 'pending': 0})
+
+
+class ActivityLogTestMixin(object):
+
+    def use_collection(self, documents=()):
+        self.collection = FakeActivityCollection(documents)
+        patcher = mock.patch.object(ActivityLog, 'book_col', new_callable=mock.PropertyMock,
+                                    return_value=self.collection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return self.collection
+
+    def activity(self, user_id, create_at):
+        return {'_id': ObjectId(), 'source_user_id': user_id, 'activity': 'read', 'create_at': create_at}
+
+
+class ActivityPageTest(ActivityLogTestMixin, SimpleTestCase):
+
+    def setUp(self):
+        moment = datetime(2020, 5, 1, 12, 0)
+        # Two runs of equal timestamps, only the _id orders them
+        self.activities = [self.activity(1, moment - timedelta(minutes=i // 3)) for i in range(9)]
+        self.activities.append(self.activity(2, moment))
+        self.use_collection(self.activities)
+        self.logger = ActivityLog()
+
+    def walk(self, limit, query=None):
+        pages, cursor = [], None
+        while True:
+            activities, cursor = self.logger.find_activity_page(query or {'source_user_id': 1}, limit, cursor)
+            pages.append([activity['_id'] for activity in activities])
+            if cursor is None:
+                return pages
+
+    def test_equal_timestamps_are_ordered_by_id(self):
+        expected = [activity['_id'] for activity in sorted(
+            self.activities[:9], key=lambda activity: (activity['create_at'], activity['_id']), reverse=True)]
+        pages = self.walk(2)
+        self.assertEqual([object_id for page in pages for object_id in page], expected)
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 2, 1])
+
+    def test_end_of_stream(self):
+        # A last page filled exactly does not announce another, empty, page
+        self.assertEqual([len(page) for page in self.walk(3)], [3, 3, 3])
+        self.assertEqual(self.walk(20, {'source_user_id': 3}), [[]])
+
+    def test_malformed_cursor(self):
+        for cursor in ('not base64!', base64.urlsafe_b64encode(b'2020-05-01T12:00:00').decode(),
+                       base64.urlsafe_b64encode(b'yesterday|5eb3e2d5a1b2c3d4e5f60718').decode(),
+                       base64.urlsafe_b64encode(b'2020-05-01T12:00:00|not an id').decode()):
+            self.assertIsNone(ActivityLog.decode_cursor(cursor))
+        first_page, _ = self.logger.find_activity_page({'source_user_id': 1}, 2)
+        self.assertEqual(self.logger.find_activity_page({'source_user_id': 1}, 2, 'not base64!')[0], first_page)
+
+    def test_cursor_round_trip(self):
+        activity = self.activities[4]
+        self.assertEqual(ActivityLog.decode_cursor(ActivityLog.encode_cursor(activity)),
+                         (activity['create_at'], activity['_id']))
+
+
+class TimelineCacheTest(ActivityLogTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='member', email='member@sun-asterisk.com', is_activate=True)
+        cls.followed = User.objects.create(username='followed', email='followed@sun-asterisk.com', is_activate=True)
+        cls.other = User.objects.create(username='other', email='other@sun-asterisk.com', is_activate=True)
+        UserFollow.objects.create(follower=cls.user, following=cls.followed, status=UserFollow.STATUS_FOLLOW[1][0])
+
+    def setUp(self):
+        cache.clear()
+        self.use_collection([self.activity(self.followed.id, datetime(2020, 5, 1, 12, i)) for i in range(3)])
+        self.logger = ActivityLog()
+
+    def get_timeline(self, following_ids=None):
+        activities, _ = self.logger.get_timeline_page(self.user, following_ids or [self.followed.id], 20)
+        return activities
+
+    def test_head_is_cached(self):
+        activities = self.get_timeline()
+        self.assertEqual(self.get_timeline(), activities)
+        # The activity of users outside the timeline does not drop it
+        touch_activity_version([self.other.id])
+        self.get_timeline()
+        self.assertEqual(self.collection.find_count, 1)
+
+    def test_new_activity_drops_head(self):
+        self.get_timeline()
+        with self.settings(MONGO_LOG=dict(settings.MONGO_LOG, ASYNC=False)):
+            self.logger.log_activity(self.followed, Book.objects.create(name='Book', description='Description'),
+                                     ActivityLog.READ)
+        self.assertEqual(len(self.get_timeline()), 4)
+        self.assertEqual(self.collection.find_count, 2)
+
+    def test_follow_drops_head(self):
+        self.get_timeline()
+        self.client.force_login(self.user)
+        self.client.post(reverse('users:user-follow'), {'following_id': self.other.id,
+                                                        'status': UserFollow.STATUS_FOLLOW[1][0]})
+        self.assertIsNone(cache.get(timeline_cache_key(self.user.id)))
+        self.get_timeline([self.followed.id, self.other.id])
+        self.assertEqual(self.collection.find_count, 2)
+
+
+class AdminDashboardViewTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', email='admin@sun-asterisk.com', is_activate=True,
+                                        role=User.ROLE_ADMIN)
+
+    def setUp(self):
+        cache.delete(DASHBOARD_CACHE_KEY)
+        self.client.force_login(self.admin)
+
+    def test_statistics_are_served_from_cache(self):
+        self.client.get(reverse('users:dashboard'))
+        Book.objects.create(name='Book', description='Description')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('users:dashboard'))
+        self.assertEqual(response.context['books_count'], 0)
+        # session, user, users login count and page
+        self.assertLessEqual(len(context), 4)
+
+    def test_refresh_now(self):
+        self.client.get(reverse('users:dashboard'))
+        Book.objects.create(name='Book', description='Description')
+        self.client.post(reverse('users:dashboard'))
+        response = self.client.get(reverse('users:dashboard'))
+        self.assertEqual(response.context['books_count'], 1)
+
+
+class UserDetailConditionalGetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='member', email='member@sun-asterisk.com', is_activate=True)
+        cls.member = User.objects.create(username='other', email='other@sun-asterisk.com', is_activate=True)
+
+    def setUp(self):
+        patcher = mock.patch.object(ActivityLog, 'get_activity_page', return_value=([], None))
+        self.get_activity_page = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.force_login(self.user)
+        self.url = reverse('users:user-detail', kwargs={'id': self.member.id})
+        # The first response sets the CSRF cookie, part of the validators
+        self.client.get(self.url)
+
+    def test_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.get_activity_page.call_count, 2)
+
+    def test_activity_is_prefetched_unless_revalidated(self):
+        threads = []
+        self.get_activity_page.side_effect = lambda **kwargs: threads.append(threading.current_thread()) or ([], None)
+        etag = self.client.get(self.url)['ETag']
+        touch_activity_version([self.member.id])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertTrue(threads[0].name.startswith('activity-log-reader'))
+        self.assertIs(threads[1], threading.current_thread())
+
+    def test_follow_changes_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        UserFollow.objects.create(follower=self.user, following=self.member, status=UserFollow.STATUS_FOLLOW[1][0])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_new_activity_changes_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        touch_activity_version([self.member.id])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class UserFollowCountsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create(username=f'member{i}', email=f'member{i}@sun-asterisk.com',
+                                         is_activate=True) for i in range(3)]
+
+    def follow(self, follower, following, status=UserFollow.STATUS_FOLLOW[1][0]):
+        self.client.force_login(follower)
+        self.client.post(reverse('users:user-follow'), {'following_id': following.id, 'status': status})
+
+    def assertCounts(self, user, follower_count, following_count):
+        user.refresh_from_db()
+        self.assertEqual((user.follower_count, user.following_count), (follower_count, following_count))
+
+    def test_counts_move_when_status_flips(self):
+        member0, member1, member2 = self.users
+        self.follow(member0, member2)
+        self.follow(member0, member2)
+        self.follow(member1, member2)
+        self.assertCounts(member2, 2, 0)
+        self.assertCounts(member0, 0, 1)
+
+        self.follow(member0, member2, UserFollow.STATUS_FOLLOW[0][0])
+        self.follow(member0, member2, UserFollow.STATUS_FOLLOW[0][0])
+        self.assertCounts(member2, 1, 0)
+        self.assertCounts(member0, 0, 0)
+
+    def test_rebuild_follow_counts(self):
+        member0, member1, member2 = self.users
+        UserFollow.objects.create(follower=member0, following=member2, status=UserFollow.STATUS_FOLLOW[1][0])
+        UserFollow.objects.create(follower=member1, following=member2, status=UserFollow.STATUS_FOLLOW[0][0])
+        User.objects.filter(pk=member1.pk).update(following_count=5)
+        call_command('rebuild_follow_counts', stdout=StringIO())
+        self.assertCounts(member0, 0, 1)
+        self.assertCounts(member1, 0, 0)
+        self.assertCounts(member2, 1, 0)
+
+
+class AvatarThumbnailTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='member', email='member@sun-asterisk.com', is_activate=True)
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root, AVATAR=dict(settings.AVATAR, ASYNC=False))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        patcher = mock.patch.object(ActivityLog, 'get_activity_page', return_value=([], None))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.force_login(self.user)
+
+    def upload(self, size=(1200, 800), mode='RGB'):
+        output = BytesIO()
+        Image.new(mode, size).save(output, 'PNG')
+        avatar = SimpleUploadedFile('avatar.png', output.getvalue(), content_type='image/png')
+        return self.client.post(reverse('users:user-update', kwargs={'id': self.user.id}),
+                                {'username': self.user.email, 'education': 'University', 'location': 'Hanoi',
+                                 'skills': 'Python', 'notes': 'Notes', 'avatar': avatar})
+
+    def test_thumbnails_are_generated(self):
+        self.upload(mode='RGBA')
+        self.user.refresh_from_db()
+        thumbnails = self.user.avatar_thumbnails
+        self.assertEqual(thumbnails['source'], self.user.avatar.name)
+        for name, size in settings.AVATAR['THUMBNAIL_SIZES'].items():
+            with self.user.avatar.storage.open(thumbnails[name]) as thumbnail:
+                self.assertEqual(Image.open(thumbnail).size, (size, size))
+        self.assertEqual(self.user.avatar_small_url, settings.MEDIA_URL + thumbnails['small'])
+
+    def test_same_content_reuses_thumbnails(self):
+        self.upload()
+        self.user.refresh_from_db()
+        thumbnails = self.user.avatar_thumbnails
+        self.upload()
+        self.user.refresh_from_db()
+        self.assertNotEqual(self.user.avatar_thumbnails['source'], thumbnails['source'])
+        self.assertEqual(self.user.avatar_thumbnails['small'], thumbnails['small'])
+
+    def test_original_is_served_until_thumbnails_exist(self):
+        self.upload()
+        User.objects.filter(pk=self.user.pk).update(avatar_thumbnails={})
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.avatar_small_url, self.user.avatar.url)
+
+        call_command('generate_avatar_thumbnails', stdout=StringIO())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.avatar_small_url, settings.MEDIA_URL + self.user.avatar_thumbnails['small'])
+
+    def test_large_upload_is_rejected(self):
+        with self.settings(AVATAR=dict(settings.AVATAR, MAX_UPLOAD_SIZE=1024)):
+            response = self.upload(size=(2000, 2000), mode='RGBA')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('avatar', response.context['form_profile'].errors)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.avatar)
+
+
+class ProcessLocalTest(SimpleTestCase):
+
+    def test_one_object_per_process(self):
+        local = ProcessLocal(object)
+        parent = local.get()
+        self.assertIs(local.get(), parent)
+        with mock.patch('utility.process.os.getpid', return_value=-1):
+            child = local.get()
+            self.assertIs(local.get(), child)
+        self.assertIsNot(child, parent)
+
+
+class UserPageQueryBudgetTest(QueryBudgetTestMixin, TestCase):
+    """Pages must run a fixed number of queries, whatever the number of rows they show."""
+    QUERY_BUDGET = 10
+    ROWS = 30
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', email='admin@sun-asterisk.com', is_activate=True,
+                                        role=User.ROLE_ADMIN)
+        book = Book.objects.create(name='Book', description='Description')
+        for i in range(cls.ROWS):
+            member = User.objects.create(username=f'member{i}', email=f'member{i}@sun-asterisk.com',
+                                         is_activate=True)
+            UserFollow.objects.create(follower=cls.admin, following=member, status=UserFollow.STATUS_FOLLOW[1][0])
+            UserFollow.objects.create(follower=member, following=cls.admin, status=UserFollow.STATUS_FOLLOW[1][0])
+            BookReadStatus.objects.create(book=book, user=member, status=1)
+            BookComment.objects.create(book=book, user=member, body=f'Comment {i}')
+        cls.member = member
+
+    def setUp(self):
+        cache.clear()
+        for method in ('get_activity_page', 'get_timeline_page'):
+            patcher = mock.patch.object(ActivityLog, method, return_value=([], None))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client.force_login(self.admin)
+
+    def test_user_urls(self):
+        self.assertUrlsQueryBudget('users', user_urls.urlpatterns, url_kwargs={None: {'id': self.member.id}},
+                                   skip=['signout'])
+
+
+class SyntheticBenchmarkTest(TestCase):
+    SCALE = {'books': 20, 'users': 10, 'categories': 4, 'statuses_per_user': 5, 'follows_per_user': 3,
+             'reviews_per_book': 1, 'activities_per_user': 0, 'batch_size': 7}
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(ActivityLog, 'get_activity_page', return_value=([], None))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def seed(self, **options):
+        call_command('seed_synthetic_data', stdout=StringIO(), **self.SCALE, **options)
+        return (
+            list(Book.objects.order_by('pk').values_list('name', 'reader_count', 'rating_sum')),
+            list(User.objects.order_by('pk').values_list('email', 'follower_count', 'following_count',
+                                                      'last_login')),
+        )
+
+    def test_seed_is_deterministic(self):
+        books, users = self.seed()
+        self.assertEqual(len(books), 20)
+        self.assertEqual(len(users), 11)
+        self.assertEqual(BookReadStatus.objects.count(), 55)
+        self.assertEqual(sum(reader_count for _, reader_count, _ in books),
+                         BookReadStatus.objects.filter(status__in=BookReadStatus.READER_STATUSES).count())
+        self.assertEqual(self.seed(clear=True), (books, users))
+
+    def test_benchmark(self):
+        self.seed()
+        output = tempfile.NamedTemporaryFile(suffix='.json')
+        self.addCleanup(output.close)
+        call_command('benchmark', requests=3, warmup=1, output=output.name, compare=output.name, stdout=StringIO(),
+                     stderr=StringIO())
+        report = json.load(output)
+        self.assertEqual(set(report['pages']),
+                         {'book-list', 'book-search', 'book-detail', 'user-detail', 'dashboard'})
+        for result in report['pages'].values():
+            self.assertEqual((result['requests'], result['errors']), (3, 0))
+            self.assertLessEqual(result['p50'], result['p99'])
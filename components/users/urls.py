@@ -2,6 +2,8 @@ from django.urls import path
 
 from .views import (
     UserDetailView,
+    UserActivityView,
+    UserTimelineView,
     AdminDashboardView,
     UserUpdateView,
     SignUpView,
@@ -24,7 +26,9 @@ urlpatterns = [
     path('users/', UserListView.as_view(), name='users-list'),
     path('user/<int:id>/edit/', UserUpdateView.as_view(), name='user-update'),
     path('user/<int:id>/', UserDetailView.as_view(), name='user-detail'),
+    path('user/<int:id>/activity/', UserActivityView.as_view(), name='user-activity'),
     path('dashboard/', AdminDashboardView.as_view(), name='dashboard'),
     path('user/follow/', UserFollowUpdateCreateView.as_view(), name='user-follow'),
-    path('user/followed/', UserFollowedListView.as_view(), name='user-followed')
+    path('user/followed/', UserFollowedListView.as_view(), name='user-followed'),
+    path('user/timeline/', UserTimelineView.as_view(), name='user-timeline')
 ]
\ No newline at end of file
@@ -1,7 +1,8 @@
+from functools import partial
+
 from django.core.files.storage import FileSystemStorage
 from django.core.paginator import Paginator
-from django.db.models import Count
-from django.http import HttpResponseForbidden
+from django.http import HttpResponseForbidden, JsonResponse, Http404
 from django.urls import reverse
 from django.shortcuts import render, redirect
 from django.contrib.auth.forms import UserCreationForm
@@ -9,6 +10,7 @@ from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from django.contrib import messages
+from django.db import transaction
 from django.views import View
 
 from .forms import (
@@ -17,11 +19,12 @@ from .forms import (
     UserUpdateForm, UserFollowForm
 )
 
-from components.books.models import Book, BookRequestBuy, BookReadStatus
-
 from .models import User, UserFollow
 from .decorators import admin_required
-from utility.log_activity import ActivityLog
+from .avatars import schedule_avatar_thumbnails
+from .stats import get_dashboard_stats, refresh_dashboard_stats
+from utility.conditional import ConditionalGetMixin
+from utility.log_activity import ActivityLog, get_activity_version
 
 logger = ActivityLog()
 
@@ -71,6 +74,7 @@ class SignOutView(View):
 
 class UserListView(View):
     template_name = 'users_list.html'
+    replica_reads = True
 
     @method_decorator(login_required)
     def get(self, request, *args, **kwargs):
@@ -78,31 +82,75 @@ class UserListView(View):
         return render(request, self.template_name, {'users': users})
 
 
-class UserDetailView(View):
+class UserDetailView(ConditionalGetMixin, View):
     template_name = 'user_detail.html'
     LIMIT_ACTIVITY = 10
 
     @method_decorator(login_required)
     def get(self, request, *args, **kwargs):
         user = User.objects.filter(id=kwargs.get('id')).first()
-        activity_log = logger.get_activity_log(user=user, limit=10)
         if not user:
             return render(request, '404.html', {'message': 'User not found'})
-
+        get_activity_page = partial(logger.get_activity_page, user=user, limit=self.LIMIT_ACTIVITY,
+                                    before=request.GET.get('before'))
+        # A page that is certainly rendered reads its activity from Mongo while the queries below run
+        activity_page = None if self.is_conditional(request) else logger.prefetch(get_activity_page)
         follow_qs = UserFollow.objects.filter(follower=request.user, following=user).first()
         follow_status = 1 if not follow_qs else follow_qs.status
-        following_count = UserFollow.objects.filter(follower=user, status=UserFollow.STATUS_FOLLOW[1][0]).count()
-        follower_count = UserFollow.objects.filter(following=user, status=UserFollow.STATUS_FOLLOW[1][0]).count()
+        etag = self.get_etag(request, user.pk, user.updated_at, follow_status, user.following_count,
+                             user.follower_count, get_activity_version(user.id))
+        response = self.not_modified(request, etag)
+        if response is not None:
+            return response
+
+        activity_log, activity_next = activity_page.result() if activity_page else get_activity_page()
         context = {
             'member': user,
             'activities': activity_log,
+            'activities_next': activity_next,
             'follow_status': follow_status,
-            'following_count': following_count,
-            'follower_count': follower_count,
+            'following_count': user.following_count,
+            'follower_count': user.follower_count,
             'form_role': kwargs.get('form_role'),
             'form_profile': kwargs.get('form_profile'),
             'form_follow': kwargs.get('form_follow')
         }
+        response = render(request, self.template_name, context=context)
+        return self.set_validators(request, response, etag, user.updated_at)
+
+
+class UserActivityView(View):
+    LIMIT_ACTIVITY = 20
+
+    @method_decorator(login_required)
+    def get(self, request, *args, **kwargs):
+        user = User.objects.filter(id=kwargs.get('id')).first()
+        if not user:
+            raise Http404('User not found')
+        activity_log, activity_next = logger.get_activity_page(user=user, limit=self.LIMIT_ACTIVITY,
+                                                               before=request.GET.get('before'))
+        activities = [{
+            'id': str(activity.pop('_id')),
+            **activity,
+        } for activity in activity_log]
+        return JsonResponse({'activities': activities, 'next': activity_next})
+
+
+class UserTimelineView(View):
+    template_name = 'user_timeline.html'
+    LIMIT_ACTIVITY = 20
+
+    @method_decorator(login_required)
+    def get(self, request, *args, **kwargs):
+        following_ids = UserFollow.objects.filter(follower=request.user, status=UserFollow.STATUS_FOLLOW[1][0]
+                                                  ).values_list('following_id', flat=True)
+        activity_log, activity_next = logger.get_timeline_page(user=request.user, following_ids=list(following_ids),
+                                                               limit=self.LIMIT_ACTIVITY,
+                                                               before=request.GET.get('before'))
+        context = {
+            'activities': activity_log,
+            'activities_next': activity_next
+        }
         return render(request, self.template_name, context=context)
 
 
@@ -111,7 +159,7 @@ class UserUpdateView(UserDetailView):
 
     @method_decorator(login_required)
     def post(self, request, *args, **kwargs):
-        user_update_form = UserUpdateForm(request.POST)
+        user_update_form = UserUpdateForm(request.POST, request.FILES)
         if user_update_form.is_valid():
             if request.user.id != kwargs.get('id') and request.user.role != 1:
                 return HttpResponseForbidden('403 Forbidden')
@@ -125,13 +173,16 @@ class UserUpdateView(UserDetailView):
             user.skills = user_update_form.cleaned_data['skills']
             user.notes = user_update_form.cleaned_data['notes']
             user.location = user_update_form.cleaned_data['location']
-            if request.FILES.get('avatar'):
-                user.avatar = request.FILES['avatar']
+            avatar = user_update_form.cleaned_data['avatar']
+            if avatar:
+                user.avatar = avatar
             user.save()
+            if avatar:
+                schedule_avatar_thumbnails(user.id)
 
             return redirect(reverse('users:user-detail', kwargs={'id': user.id}))
         kwargs.update({'form_profile': user_update_form})
-        response = self.get(request, *kwargs)
+        response = self.get(request, **kwargs)
         return response
 
 
@@ -165,13 +216,14 @@ class UserFollowUpdateCreateView(UserDetailView):
             follower = request.user
             following = follow_form.cleaned_data['following_id']
             status = follow_form.cleaned_data['status']
-            follow_qs = UserFollow.objects.filter(follower=follower, following__id=following).first()
-            if not follow_qs:
-                following_user = User.objects.get(id=following)
-                UserFollow.objects.create(follower=follower, following=following_user, status=status)
-            else:
-                follow_qs.status = status
-                follow_qs.save()
+            following_user = User.objects.get(id=following)
+            with transaction.atomic():
+                follow_qs, created = UserFollow.objects.select_for_update().get_or_create(
+                    follower=follower,
+                    following=following_user
+                )
+                follow_qs.set_status(status)
+            logger.invalidate_timeline(follower)
 
             return redirect(reverse('users:user-detail', kwargs={'id': following}))
         kwargs.update({'form_follow': follow_form})
@@ -181,37 +233,24 @@ class UserFollowUpdateCreateView(UserDetailView):
 
 class AdminDashboardView(View):
     template_name = 'dashboard.html'
+    replica_reads = True
+    users_login_paginate_by = 10
 
     @method_decorator(admin_required)
     def get(self, request, *args, **kwargs):
-        users_count = User.objects.all().count()
-        books_count = Book.objects.all().count()
-        books_request_buy_count = BookRequestBuy.objects.filter(status=BookRequestBuy.STATUS_CHOICES[0][0]).count()
-        most_read_books = BookReadStatus.objects.filter(status__in=[1, 2]).values('book__id',
-                                                                                  'book__name',
-                                                                                  'book__author').annotate(
-            total=Count('book')).order_by('-total')[:5]
-        most_followed_users = UserFollow.objects.filter(status=2).values('following__id',
-                                                                         'following__username',
-                                                                         'following__role').annotate(
-            total=Count('following')).order_by('-total')[:5]
-        most_read_book_members = BookReadStatus.objects.filter(status__in=[1, 2]).values('user__id',
-                                                                                         'user__username',
-                                                                                         'user__role').annotate(
-            total=Count('user')).order_by('-total')[:5]
-        users_login = User.objects.filter(is_activate=True).order_by('-last_login')
-        context = {
-            'users_count': users_count,
-            'books_count': books_count,
-            'books_request_buy_count': books_request_buy_count,
-            'most_read_books': most_read_books,
-            'most_followed_users': most_followed_users,
-            'most_read_book_members': most_read_book_members,
-            'users_login': users_login
-
-        }
+        users_login = User.objects.filter(is_activate=True).order_by('-last_login', '-id').only(
+            'id', 'username', 'role', 'last_login')
+        paginator = Paginator(users_login, self.users_login_paginate_by)
+        context = dict(get_dashboard_stats())
+        context['users_login'] = paginator.get_page(request.GET.get('login_page'))
         return render(request, self.template_name, context=context)
 
+    @method_decorator(admin_required)
+    def post(self, request, *args, **kwargs):
+        refresh_dashboard_stats()
+        messages.success(request, 'Dashboard statistics refreshed!')
+        return redirect(reverse('users:dashboard'))
+
 
 class UserFollowedListView(View):
     template_name = 'user_followed_list.html'
@@ -219,7 +258,9 @@ class UserFollowedListView(View):
 
     @method_decorator(login_required)
     def get(self, request, *args, **kwargs):
-        users_followed = UserFollow.objects.filter(follower=request.user, status=UserFollow.STATUS_FOLLOW[1][0])
+        users_followed = UserFollow.objects.filter(
+            follower=request.user, status=UserFollow.STATUS_FOLLOW[1][0]
+        ).select_related('following').order_by('-updated_at', '-id')
 
         paginator = Paginator(users_followed, self.paginate_by)
         page_number = request.GET.get('page')
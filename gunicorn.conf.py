@@ -0,0 +1,22 @@
+# ASGI deployment, the alternative to uwsgi.ini: gunicorn -c gunicorn.conf.py brs.asgi:application
+import os
+
+project = 'brs'
+base = '/Users/minhhahao/workspace/first-project-training'
+
+chdir = f'{base}/{project}'
+worker_class = 'uvicorn.workers.UvicornWorker'
+workers = 5
+
+bind = '127.0.0.1:8000'
+daemon = True
+errorlog = f'{chdir}/logs/gunicorn/brs.log'
+accesslog = f'{chdir}/logs/gunicorn/access.log'
+
+# Static files are served by nginx (see README), uvicorn does not serve them
+raw_env = [
+    f'DJANGO_SETTINGS_MODULE={project}.settings',
+    'LANG=en_US.UTF-8',
+    # Threads running the views of each worker, each one keeps its own database connection
+    f"ASGI_THREADS={os.getenv('ASGI_THREADS', 8)}",
+]
@@ -0,0 +1,24 @@
+import django
+from django.core.handlers import asgi
+from django.db import close_old_connections
+
+
+class ASGIHandler(asgi.ASGIHandler):
+    """Django's ASGI handler, closing the database connections of the thread that ran the view.
+
+    Django 3.0 runs each (synchronous) view on a thread of the ASGI_THREADS pool but sends the
+    request_started and request_finished signals from other threads, so the connection of the view
+    thread would never be closed when CONN_MAX_AGE expires nor checked by CONN_HEALTH_CHECKS.
+    """
+
+    def get_response(self, request):
+        close_old_connections()
+        try:
+            return super().get_response(request)
+        finally:
+            close_old_connections()
+
+
+def get_asgi_application():
+    django.setup(set_prefix=False)
+    return ASGIHandler()
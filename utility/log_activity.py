@@ -1,10 +1,187 @@
+import atexit
+import base64
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 
+from bson import ObjectId
+from bson.errors import InvalidId
 from django.conf import settings
+from django.core.cache import cache
 import pymongo
+from pymongo.errors import PyMongoError
 
 from components.users.models import User
-from components.books.models import Book, BookReview
+from components.books.models import Book, BookComment
+from utility.mongo import get_mongo_db
+from utility.perf import bind_metrics
+from utility.process import ProcessLocal
+
+log = logging.getLogger(__name__)
+
+_indexes_ensured = set()
+
+
+class ActivityLogWriter(object):
+    """Buffer activity documents in process and write them with insert_many from a background thread.
+
+    Under uWSGI the thread only runs with enable-threads, see uwsgi.ini.
+    """
+    OVERFLOW_DROP = 'drop'
+    OVERFLOW_BLOCK = 'block'
+
+    def __init__(self, collection, batch_size=100, flush_interval=1.0, queue_size=10000,
+                 overflow=OVERFLOW_DROP, block_timeout=0.05, on_flush=None):
+        self.collection = collection
+        self.on_flush = on_flush
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.counters = {'queued': 0, 'flushed': 0, 'dropped': 0, 'failed': 0}
+        self._counters_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._stopping = threading.Event()
+        atexit.register(self.stop)
+
+    def _count(self, name, value=1):
+        with self._counters_lock:
+            self.counters[name] += value
+
+    def stats(self):
+        with self._counters_lock:
+            stats = dict(self.counters)
+        # Queued events not written yet, whether still in the queue or in the batch being written
+        stats['pending'] = stats['queued'] - stats['flushed'] - stats['failed']
+        return stats
+
+    def _ensure_started(self):
+        # Threads do not survive fork, so a worker forked after the first write starts its own.
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='activity-log-writer', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def write(self, data):
+        if self._stopping.is_set():
+            self._count('dropped')
+            return False
+        self._ensure_started()
+        try:
+            if self.overflow == self.OVERFLOW_BLOCK:
+                self._queue.put(data, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(data)
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._count('queued')
+        return True
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                item = None
+            if item is not None:
+                batch.append(item)
+            stopping = self._stopping.is_set() and self._queue.empty()
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline or stopping:
+                self._flush(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+            if stopping:
+                return
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        try:
+            self.collection.insert_many(batch, ordered=False)
+            self._count('flushed', len(batch))
+        except PyMongoError:
+            self._count('failed', len(batch))
+            log.exception('Could not write %s activity logs', len(batch))
+            return
+        if self.on_flush:
+            self.on_flush(batch)
+
+    def stop(self, timeout=5.0):
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._stopping.set()
+        try:
+            # Wake the thread up if it is waiting for the next event or the flush interval
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        log.info('Activity log writer stopped: %s', self.stats())
+
+
+def activity_version_key(user_id):
+    return f'activity:version:{user_id}'
+
+
+def timeline_cache_key(user_id):
+    return f'activity:timeline:{user_id}'
+
+
+def touch_activity_version(user_ids):
+    """Mark the activity of these users as changed, cached timelines including them become stale."""
+    version = time.time_ns()
+    cache.set_many({activity_version_key(user_id): version for user_id in set(user_ids)}, None)
+
+
+def get_activity_version(user_id):
+    """Current activity version of a user, started now when unknown so an evicted version never repeats."""
+    key = activity_version_key(user_id)
+    cache.add(key, time.time_ns(), None)
+    return cache.get(key)
+
+
+def _create_activity_writer():
+    return ActivityLogWriter(
+        get_mongo_db()['activity'],
+        batch_size=settings.MONGO_LOG.get('BATCH_SIZE'),
+        flush_interval=settings.MONGO_LOG.get('FLUSH_INTERVAL'),
+        queue_size=settings.MONGO_LOG.get('QUEUE_SIZE'),
+        overflow=settings.MONGO_LOG.get('OVERFLOW'),
+        block_timeout=settings.MONGO_LOG.get('BLOCK_TIMEOUT'),
+        on_flush=lambda batch: touch_activity_version(data['source_user_id'] for data in batch)
+    )
+
+
+_writers = ProcessLocal(_create_activity_writer)
+_readers = ProcessLocal(lambda: ThreadPoolExecutor(max_workers=settings.MONGO_LOG.get('READ_THREADS'),
+                                                   thread_name_prefix='activity-log-reader'))
+
+
+def get_activity_writer():
+    """Return the buffered writer shared by every ActivityLog of the current process."""
+    return _writers.get()
+
+
+def get_activity_reader():
+    """Return the thread pool running the activity reads started by ActivityLog.prefetch in the current process."""
+    return _readers.get()
 
 
 class ActivityLog(object):
@@ -19,12 +196,35 @@ class ActivityLog(object):
     UNFLLOW = 'unfollowed the user'
     COMMENT = 'commented on book'
 
-    def __init__(self):
-        self.host = settings.MONGO_LOG.get('HOST')
-        self.port = settings.MONGO_LOG.get('PORT')
-        self.client = pymongo.MongoClient(f'mongodb://{self.host}:{self.port}/')
-        self.db = self.client[settings.MONGO_LOG.get('NAME')]
-        self.book_col = self.db['activity']
+    # Only the fields rendered by the activity timeline are fetched
+    PROJECTION = {
+        'source_user': True,
+        'source_user_id': True,
+        'activity': True,
+        'create_at': True,
+        'obj_target': True,
+        'obj_target_id': True,
+        'obj_target_name': True,
+        'obj_target_content': True,
+    }
+    INDEXES = [
+        ([('source_user_id', pymongo.ASCENDING), ('create_at', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)],
+         'source_user_id_create_at'),
+    ]
+
+    @property
+    def db(self):
+        return get_mongo_db()
+
+    @property
+    def book_col(self):
+        return self.db['activity']
+
+    @property
+    def writer(self):
+        if settings.MONGO_LOG.get('ASYNC'):
+            return get_activity_writer()
+        return None
 
     def log_activity(self, source_user: User, obj_target, activity, option_content=None):
         data = {
@@ -37,18 +237,115 @@ class ActivityLog(object):
             data.update({'obj_target_name': obj_target.name, 'obj_target_id': obj_target.id, 'obj_target': 'book'})
         if isinstance(obj_target, User):
             data.update({'obj_target_name': obj_target.username, 'obj_target_id': obj_target.id, 'obj_target': 'user'})
-        if isinstance(obj_target, BookReview):
+        if isinstance(obj_target, BookComment):
             data.update({
                 'obj_target_name': obj_target.book.name,
                 'obj_target_id': obj_target.book.id,
                 'obj_target': 'comment',
                 'obj_target_content': option_content})
-        self.book_col.insert_one(data)
+        writer = self.writer
+        if writer:
+            writer.write(data)
+        else:
+            self.book_col.insert_one(data)
+            touch_activity_version([source_user.id])
 
-    def get_activity_log(self, user: User, limit: int):
-        data_book = self.book_col.find({
-            'source_user': user.username,
-            'source_user_id': user.id
-        }).sort("create_at", -1).limit(limit)
+    def prefetch(self, read):
+        """Start read (e.g. a partial of get_activity_page) on the reader pool and return its Future.
+
+        The view runs its SQL queries while Mongo answers, result() returns the page or raises the error
+        of the read. With MONGO_LOG['READ_THREADS'] = 0 the read runs at once on the calling thread.
+        """
+        if not settings.MONGO_LOG.get('READ_THREADS'):
+            future = Future()
+            try:
+                future.set_result(read())
+            except Exception as error:
+                future.set_exception(error)
+            return future
+        return get_activity_reader().submit(bind_metrics(read))
+
+    def ensure_indexes(self):
+        for keys, name in self.INDEXES:
+            self.book_col.create_index(keys, name=name, background=True)
+        _indexes_ensured.add(os.getpid())
+
+    @staticmethod
+    def encode_cursor(activity):
+        raw = f"{activity['create_at'].isoformat()}|{activity['_id']}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
 
-        return data_book
+    @staticmethod
+    def decode_cursor(cursor):
+        """Return the (create_at, _id) of a cursor or None when it is missing or malformed."""
+        if not cursor:
+            return None
+        try:
+            create_at, object_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+            return datetime.fromisoformat(create_at), ObjectId(object_id)
+        except (ValueError, InvalidId):
+            return None
+
+    def find_activity_page(self, query: dict, limit: int, before=None):
+        """Return the activities matching query newer first and the cursor of the next (older) page.
+
+        Pages are read by keyset on (create_at, _id) so deep pages cost the same as the first one.
+        """
+        if settings.MONGO_LOG.get('ENSURE_INDEXES') and os.getpid() not in _indexes_ensured:
+            self.ensure_indexes()
+
+        position = self.decode_cursor(before)
+        if position:
+            create_at, object_id = position
+            query = {'$and': [query, {'$or': [
+                {'create_at': {'$lt': create_at}},
+                {'create_at': create_at, '_id': {'$lt': object_id}},
+            ]}]}
+        activities = list(self.book_col.find(query, self.PROJECTION).sort([
+            ('create_at', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)
+        ]).limit(limit + 1))
+
+        next_cursor = None
+        if len(activities) > limit:
+            activities = activities[:limit]
+            next_cursor = self.encode_cursor(activities[-1])
+        return activities, next_cursor
+
+    def get_activity_page(self, user: User, limit: int, before=None):
+        return self.find_activity_page({'source_user_id': user.id}, limit, before)
+
+    def get_timeline_page(self, user: User, following_ids, limit: int, before=None):
+        """Return one merged page of the activity of following_ids with a single $in query.
+
+        The first page is cached per user while neither the followed users nor their activity change.
+        """
+        following_ids = sorted(following_ids)
+        if not following_ids:
+            return [], None
+        query = {'source_user_id': {'$in': following_ids}}
+        timeout = settings.MONGO_LOG.get('TIMELINE_CACHE_TIMEOUT')
+        if before or not timeout:
+            return self.find_activity_page(query, limit, before)
+
+        versions = cache.get_many([activity_version_key(user_id) for user_id in following_ids])
+        head = cache.get(timeline_cache_key(user.id))
+        if head and head['following_ids'] == following_ids and head['limit'] == limit \
+                and head['versions'] == versions:
+            return head['activities'], head['next']
+
+        activities, next_cursor = self.find_activity_page(query, limit)
+        cache.set(timeline_cache_key(user.id), {
+            'following_ids': following_ids,
+            'limit': limit,
+            'versions': versions,
+            'activities': activities,
+            'next': next_cursor,
+        }, timeout)
+        return activities, next_cursor
+
+    def invalidate_timeline(self, user: User):
+        cache.delete(timeline_cache_key(user.id))
+
+    def get_activity_log(self, user: User, limit: int):
+        activities, _ = self.get_activity_page(user, limit)
+        return activities
@@ -0,0 +1,29 @@
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+
+
+class MigrationTestCase(TransactionTestCase):
+    """Run the data migrations up to migrate_to on rows created at the state of migrate_from.
+
+    setUp migrates the app back to migrate_from and exposes its historical models as self.old_apps,
+    migrate() applies migrate_to and returns the models of that state. The other apps stay at their
+    latest migration and everything is migrated forward again after the test.
+    """
+    migrate_from = None
+    migrate_to = None
+
+    def setUp(self):
+        super().setUp()
+        executor = MigrationExecutor(connection)
+        leaf_nodes = executor.loader.graph.leaf_nodes()
+        # A cleanup also runs when setUp fails, the next tests need the latest schema
+        self.addCleanup(lambda: MigrationExecutor(connection).migrate(leaf_nodes))
+        self.other_nodes = [node for node in leaf_nodes if node[0] != self.migrate_from[0]]
+        self.old_apps = self.migrate(self.migrate_from)
+
+    def migrate(self, target=None):
+        target = target or self.migrate_to
+        executor = MigrationExecutor(connection)
+        executor.migrate([target])
+        return executor.loader.project_state([target] + self.other_nodes).apps
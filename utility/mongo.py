@@ -0,0 +1,37 @@
+from django.conf import settings
+import pymongo
+
+from utility.perf import MongoCommandListener
+from utility.process import ProcessLocal
+
+
+def _create_mongo_client():
+    host = settings.MONGO_LOG.get('HOST')
+    port = settings.MONGO_LOG.get('PORT')
+    return pymongo.MongoClient(
+        f'mongodb://{host}:{port}/',
+        maxPoolSize=settings.MONGO_LOG.get('MAX_POOL_SIZE'),
+        minPoolSize=settings.MONGO_LOG.get('MIN_POOL_SIZE'),
+        connectTimeoutMS=settings.MONGO_LOG.get('CONNECT_TIMEOUT_MS'),
+        socketTimeoutMS=settings.MONGO_LOG.get('SOCKET_TIMEOUT_MS'),
+        serverSelectionTimeoutMS=settings.MONGO_LOG.get('SERVER_SELECTION_TIMEOUT_MS'),
+        waitQueueTimeoutMS=settings.MONGO_LOG.get('WAIT_QUEUE_TIMEOUT_MS'),
+        event_listeners=[MongoCommandListener()],
+        connect=False
+    )
+
+
+_clients = ProcessLocal(_create_mongo_client)
+
+
+def get_mongo_client():
+    """Return the MongoClient of the current process, creating it on first use.
+
+    Nothing touches the network at import time and a worker forked by uWSGI never
+    reuses the client (and sockets) of its parent, it builds its own pool instead.
+    """
+    return _clients.get()
+
+
+def get_mongo_db():
+    return get_mongo_client()[settings.MONGO_LOG.get('NAME')]
@@ -0,0 +1,127 @@
+import base64
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+
+
+def estimate_count(queryset):
+    """Return the number of rows the Postgres planner expects queryset to return."""
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPage(object):
+
+    def __init__(self, object_list, count, is_approximate_count, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.count = count
+        self.is_approximate_count = is_approximate_count
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class KeysetPaginator(object):
+    """Paginate a queryset newest first by (field, pk) with opaque cursors instead of OFFSET.
+
+    Every page costs one indexed range scan whatever its depth, and the total is estimated
+    by the planner once it goes over APPROXIMATE_COUNT_THRESHOLD rows instead of a COUNT(*).
+    """
+    NEXT = 'n'
+    PREVIOUS = 'p'
+
+    def __init__(self, queryset, per_page, field='updated_at'):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.field = field
+
+    @staticmethod
+    def encode_cursor(direction, value, pk):
+        raw = json.dumps([direction, value.isoformat(), pk])
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        if not cursor:
+            return None
+        try:
+            direction, value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            return direction, datetime.fromisoformat(value), int(pk)
+        except (ValueError, TypeError):
+            return None
+
+    def count(self):
+        estimate = estimate_count(self.queryset)
+        if estimate > settings.APPROXIMATE_COUNT_THRESHOLD:
+            return estimate, True
+        return self.queryset.count(), False
+
+    def get_page(self, cursor):
+        position = self.decode_cursor(cursor)
+        direction = position[0] if position else self.NEXT
+        queryset = self.queryset
+        if position:
+            _, value, pk = position
+            if direction == self.PREVIOUS:
+                queryset = queryset.filter(Q(**{f'{self.field}__gte': value}) &
+                                           (Q(**{f'{self.field}__gt': value}) | Q(pk__gt=pk)))
+            else:
+                queryset = queryset.filter(Q(**{f'{self.field}__lte': value}) &
+                                           (Q(**{f'{self.field}__lt': value}) | Q(pk__lt=pk)))
+        if direction == self.PREVIOUS:
+            queryset = queryset.order_by(self.field, 'pk')
+        else:
+            queryset = queryset.order_by(f'-{self.field}', '-pk')
+
+        object_list = list(queryset[:self.per_page + 1])
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+        if direction == self.PREVIOUS:
+            object_list.reverse()
+
+        next_cursor = previous_cursor = None
+        if object_list:
+            first, last = object_list[0], object_list[-1]
+            if has_more or direction == self.PREVIOUS:
+                next_cursor = self.encode_cursor(self.NEXT, getattr(last, self.field), last.pk)
+            if position and (has_more or direction == self.NEXT):
+                previous_cursor = self.encode_cursor(self.PREVIOUS, getattr(first, self.field), first.pk)
+        count, is_approximate_count = self.count()
+        return KeysetPage(object_list, count, is_approximate_count, next_cursor, previous_cursor)
+
+
+class ListPaginationMixin(object):
+    """Paginate a list view by page number or, with settings.LIST_PAGINATION = 'keyset', by cursor."""
+    paginate_by = 25
+
+    def paginate(self, request, queryset, context_name):
+        if settings.LIST_PAGINATION == 'keyset':
+            query_params = request.GET.copy()
+            query_params.pop('cursor', None)
+            return {
+                context_name: KeysetPaginator(queryset, self.paginate_by).get_page(request.GET.get('cursor')),
+                'keyset_pagination': True,
+                'query_params': query_params.urlencode()
+            }
+        paginator = Paginator(queryset.order_by('-updated_at', '-id'), self.paginate_by)
+        return {context_name: paginator.get_page(request.GET.get('page'))}
@@ -0,0 +1,314 @@
+import atexit
+import glob
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template
+from pymongo import monitoring
+
+from utility.process import ProcessLocal
+from utility.querycheck import QueryInspector
+
+log = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class RequestMetrics(object):
+    """Costs accumulated by the request running on the current thread."""
+
+    def __init__(self):
+        self.db_count = 0
+        self.db_time = 0.0
+        self.mongo_count = 0
+        self.mongo_time = 0.0
+        self.template_time = 0.0
+        self.db_connections = 0
+
+
+def current_metrics():
+    return getattr(_local, 'metrics', None)
+
+
+def bind_metrics(func):
+    """Wrap func so the costs it has when called on another thread (e.g. a pool) count for the current request."""
+    metrics = current_metrics()
+
+    def run(*args, **kwargs):
+        _local.metrics = metrics
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.metrics = None
+    return run
+
+
+class Histogram(object):
+    """Log-linear histogram, each bucket is 10% wider than the previous one so percentiles are within 10%.
+
+    Buckets are plain counters, histograms of several processes merge by adding them.
+    """
+    GROWTH = 1.1
+
+    def __init__(self, buckets=None, count=0, total=0.0):
+        self.buckets = {int(index): value for index, value in (buckets or {}).items()}
+        self.count = count
+        self.total = total
+
+    def add(self, value):
+        if value <= 0:
+            index = -1
+        elif value < 1:
+            index = 0
+        else:
+            index = int(math.log(value, self.GROWTH)) + 1
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+
+    def merge(self, other):
+        for index, value in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + value
+        self.count += other.count
+        self.total += other.total
+
+    def percentile(self, percent):
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * percent / 100)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                # Upper bound of the bucket
+                return 0.0 if index < 0 else 1.0 if index == 0 else self.GROWTH ** index
+        return self.GROWTH ** max(self.buckets)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def to_dict(self):
+        return {'buckets': self.buckets, 'count': self.count, 'total': self.total}
+
+
+class PerfRecorder(object):
+    """Per view histograms of one process, written to PERF['SINK_DIR']/perf-<pid>.json every FLUSH_INTERVAL.
+
+    Events (e.g. database connections opened) are counted per minute over the last EVENT_MINUTES.
+    """
+    METRICS = ('total', 'db', 'queries', 'mongo', 'template')
+    EVENT_MINUTES = 60
+
+    def __init__(self, sink_dir, flush_interval):
+        self.sink_dir = sink_dir
+        self.flush_interval = flush_interval
+        self.views = {}
+        self.events = {}
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    def record(self, view_name, values):
+        with self._lock:
+            histograms = self.views.setdefault(view_name, {name: Histogram() for name in self.METRICS})
+            for name, value in values.items():
+                histograms[name].add(value)
+            due = time.monotonic() - self._flushed_at >= self.flush_interval
+        if due:
+            self.flush()
+
+    def count_event(self, name):
+        minute = int(time.time() // 60)
+        with self._lock:
+            counts = self.events.setdefault(name, {})
+            counts[minute] = counts.get(minute, 0) + 1
+            for old_minute in [old_minute for old_minute in counts if old_minute <= minute - self.EVENT_MINUTES]:
+                del counts[old_minute]
+            due = time.monotonic() - self._flushed_at >= self.flush_interval
+        if due:
+            self.flush()
+
+    def snapshot(self):
+        with self._lock:
+            return {view_name: {name: histogram.to_dict() for name, histogram in histograms.items()}
+                    for view_name, histograms in self.views.items()}
+
+    def events_snapshot(self):
+        with self._lock:
+            return {name: dict(counts) for name, counts in self.events.items()}
+
+    def flush(self):
+        self._flushed_at = time.monotonic()
+        if not self.sink_dir:
+            return
+        path = os.path.join(self.sink_dir, f'perf-{os.getpid()}.json')
+        try:
+            os.makedirs(self.sink_dir, exist_ok=True)
+            # Readers never see a partial file
+            with open(f'{path}.tmp', 'w') as sink:
+                json.dump({'pid': os.getpid(), 'written_at': time.time(), 'views': self.snapshot(),
+                           'events': self.events_snapshot()}, sink)
+            os.replace(f'{path}.tmp', path)
+        except OSError:
+            log.exception('Could not write the performance histograms to %s', path)
+
+
+def _create_perf_recorder():
+    recorder = PerfRecorder(settings.PERF.get('SINK_DIR'), settings.PERF.get('FLUSH_INTERVAL'))
+    atexit.register(recorder.flush)
+    return recorder
+
+
+_recorders = ProcessLocal(_create_perf_recorder)
+
+
+def get_perf_recorder():
+    """Return the recorder of the current (forked) process."""
+    return _recorders.get()
+
+
+def load_perf_histograms(sink_dir):
+    """Merge the histograms written by every process into {view name: {metric: Histogram}}."""
+    views = {}
+    for path in glob.glob(os.path.join(sink_dir, 'perf-*.json')):
+        with open(path) as sink:
+            data = json.load(sink)
+        for view_name, histograms in data['views'].items():
+            merged = views.setdefault(view_name, {name: Histogram() for name in PerfRecorder.METRICS})
+            for name, histogram in histograms.items():
+                merged[name].merge(Histogram(**histogram))
+    return views
+
+
+def load_perf_events(sink_dir):
+    """Merge the event counts written by every process into {event name: {minute: count}}."""
+    events = {}
+    for path in glob.glob(os.path.join(sink_dir, 'perf-*.json')):
+        with open(path) as sink:
+            data = json.load(sink)
+        for name, counts in data.get('events', {}).items():
+            merged = events.setdefault(name, {})
+            for minute, count in counts.items():
+                merged[int(minute)] = merged.get(int(minute), 0) + count
+    return events
+
+
+def record_connection_event(event, alias):
+    """Count a database connection event (opened, unusable) of the current process and request."""
+    if not settings.PERF.get('ENABLED'):
+        return
+    metrics = current_metrics()
+    if metrics is not None and event == 'opened':
+        metrics.db_connections += 1
+    get_perf_recorder().count_event(f'db.{alias}.{event}')
+
+
+def _time_query(execute, sql, params, many, context):
+    metrics = current_metrics()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.db_count += 1
+        metrics.db_time += time.perf_counter() - start
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Count the Mongo commands run by the thread of a request (the activity log writer thread has none)."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+    def _record(self, event):
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.mongo_count += 1
+            metrics.mongo_time += event.duration_micros / 1e6
+
+
+class TimedTemplate(Template):
+
+    def render(self, context=None, request=None):
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics = current_metrics()
+            if metrics is not None:
+                metrics.template_time += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """DjangoTemplates backend timing the render of the templates views ask for (includes are part of it)."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return TimedTemplate(template.template, self)
+
+
+class PerformanceMiddleware(object):
+    """Measure each request: wall time, SQL queries, Mongo commands and template rendering.
+
+    The costs are sent back in a Server-Timing header and added to the per view histograms
+    read by the perf_report command. With PERF['N_PLUS_ONE_THRESHOLD'] set (staging), requests
+    repeating a query shape that many times are logged with the template lines running them.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.PERF.get('ENABLED'):
+            return self.get_response(request)
+
+        metrics = _local.metrics = RequestMetrics()
+        n_plus_one_threshold = settings.PERF.get('N_PLUS_ONE_THRESHOLD')
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(_time_query))
+                if n_plus_one_threshold:
+                    inspector = stack.enter_context(QueryInspector())
+                response = self.get_response(request)
+        finally:
+            _local.metrics = None
+        total = time.perf_counter() - start
+
+        if n_plus_one_threshold and inspector.repeated(n_plus_one_threshold):
+            log.warning('N+1 queries on %s\n%s', request.path, inspector.report(n_plus_one_threshold))
+
+        if settings.PERF.get('SERVER_TIMING'):
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.db_count} queries, '
+                f'{metrics.db_connections} connections opened"',
+                f'mongo;dur={metrics.mongo_time * 1000:.1f};desc="{metrics.mongo_count} calls"',
+                f'tpl;dur={metrics.template_time * 1000:.1f}',
+                f'total;dur={total * 1000:.1f}',
+            ])
+        match = request.resolver_match
+        get_perf_recorder().record(match.view_name if match else 'unresolved', {
+            'total': total * 1000,
+            'db': metrics.db_time * 1000,
+            'queries': metrics.db_count,
+            'mongo': metrics.mongo_time * 1000,
+            'template': metrics.template_time * 1000,
+        })
+        return response
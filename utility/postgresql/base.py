@@ -0,0 +1,40 @@
+from django.db.backends.postgresql import base
+
+from utility.perf import record_connection_event
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """PostgreSQL backend checking a persistent connection before the first query of each request reuses it.
+
+    Enabled by CONN_HEALTH_CHECKS in the database settings (built in from Django 4.1): a connection the
+    server or a pooler dropped while the worker was idle is replaced instead of failing the request.
+    Connection opens and failed checks are counted for the perf_report command.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_done = False
+
+    @property
+    def health_check_enabled(self):
+        return self.settings_dict.get('CONN_HEALTH_CHECKS', False)
+
+    def connect(self):
+        # A new connection needs no check, set first as connecting already runs queries
+        self.health_check_done = True
+        super().connect()
+        record_connection_event('opened', self.alias)
+
+    def close_if_unusable_or_obsolete(self):
+        # Called when a request starts and ends
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
+
+    def ensure_connection(self):
+        if self.connection is not None and self.health_check_enabled and not self.health_check_done \
+                and not self.in_atomic_block:
+            self.health_check_done = True
+            if not self.is_usable():
+                record_connection_event('unusable', self.alias)
+                self.close()
+        super().ensure_connection()
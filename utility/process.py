@@ -0,0 +1,28 @@
+import os
+import threading
+
+
+class ProcessLocal(object):
+    """Build an object with factory on first use, once per (forked) process.
+
+    Clients, threads and pools do not survive fork: a worker forked by uWSGI never reuses the
+    object of its parent, it builds its own instead.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def get(self):
+        pid = os.getpid()
+        value = self._values.get(pid)
+        if value is None:
+            with self._lock:
+                value = self._values.get(pid)
+                if value is None:
+                    # Forget the parent's object without closing it, the parent still uses it
+                    self._values.clear()
+                    value = self.factory()
+                    self._values[pid] = value
+        return value
@@ -0,0 +1,132 @@
+import os
+import re
+import sys
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.urls import reverse
+
+IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+NUMBER_RE = re.compile(r'\b\d+\b')
+# Wrappers every query goes through, the interesting project frame is further up
+IGNORED_FILES = (__file__, os.path.join(os.path.dirname(__file__), 'perf.py'))
+
+
+def query_shape(sql):
+    """SQL without its literals, queries that only differ by their parameters share a shape."""
+    return NUMBER_RE.sub('?', IN_LIST_RE.sub('IN (...)', sql))
+
+
+def query_location():
+    """Return (template:line, file:line) of the template tag and the project code running the current query."""
+    template = None
+    code = None
+    frame = sys._getframe(1)
+    while frame is not None and (template is None or code is None):
+        if template is None and frame.f_code.co_name == 'render_annotated':
+            node = frame.f_locals.get('self')
+            origin = getattr(node, 'origin', None)
+            token = getattr(node, 'token', None)
+            if origin is not None and token is not None:
+                template = f'{origin.template_name}:{token.lineno}'
+        filename = frame.f_code.co_filename
+        if code is None and filename.startswith(settings.BASE_DIR) and filename not in IGNORED_FILES \
+                and 'site-packages' not in filename:
+            code = f'{os.path.relpath(filename, settings.BASE_DIR)}:{frame.f_lineno}'
+        frame = frame.f_back
+    return template, code
+
+
+class RecordedQuery(object):
+
+    def __init__(self, sql, duration, template, code):
+        self.sql = sql
+        self.shape = query_shape(sql)
+        self.duration = duration
+        self.template = template
+        self.code = code
+
+    def location(self):
+        return f"{self.template or 'no template'}, {self.code or 'no project code'}"
+
+
+class QueryInspector(object):
+    """Record the queries run inside the block with where they come from, to spot N+1 patterns.
+
+    Walking the stack of every query is slow, use it in tests and on staging only.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self._record))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def _record(self, execute, sql, params, many, context):
+        template, code = query_location()
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(RecordedQuery(sql, time.perf_counter() - start, template, code))
+
+    def repeated(self, threshold):
+        """Queries of every shape run at least threshold times, most repeated first."""
+        counts = Counter(query.shape for query in self.queries)
+        return [[query for query in self.queries if query.shape == shape]
+                for shape, count in counts.most_common() if count >= threshold]
+
+    def report(self, threshold=None):
+        counts = Counter(query.shape for query in self.queries)
+        lines = [f'{len(self.queries)} queries:']
+        for shape, count in counts.items():
+            query = next(query for query in self.queries if query.shape == shape)
+            lines.append(f'  {count}x {query.sql[:300]} [{query.location()}]')
+        for queries in self.repeated(threshold) if threshold else []:
+            locations = Counter(query.location() for query in queries)
+            lines.append(f'Repeated {len(queries)} times (N+1?): {queries[0].shape}')
+            lines += [f'  from {location} ({count}x)' for location, count in locations.most_common()]
+        return '\n'.join(lines)
+
+
+class QueryBudgetTestMixin(object):
+    """TestCase helpers failing a page that runs too many queries or the same query once per row."""
+    QUERY_BUDGET = 10
+    N_PLUS_ONE_THRESHOLD = 3
+
+    def assertQueryBudget(self, url, budget=None, status_codes=(200,)):
+        budget = budget or self.QUERY_BUDGET
+        with QueryInspector() as inspector:
+            response = self.client.get(url)
+        self.assertIn(response.status_code, status_codes, url)
+        repeated = inspector.repeated(self.N_PLUS_ONE_THRESHOLD)
+        if len(inspector.queries) > budget or repeated:
+            self.fail(f'{url} ran {len(inspector.queries)} queries (budget {budget})\n'
+                      f'{inspector.report(self.N_PLUS_ONE_THRESHOLD)}')
+        return response
+
+    def assertUrlsQueryBudget(self, namespace, urlpatterns, url_kwargs=None, budgets=None, skip=()):
+        """Run assertQueryBudget on every view of urlpatterns answering GET.
+
+        url_kwargs maps a url name to its kwargs (None for the default), budgets a url name to its budget.
+        """
+        url_kwargs = url_kwargs or {}
+        budgets = budgets or {}
+        for pattern in urlpatterns:
+            view_class = getattr(pattern.callback, 'view_class', None)
+            if pattern.name in skip or view_class is None or not hasattr(view_class, 'get'):
+                continue
+            kwargs = url_kwargs.get(pattern.name, url_kwargs.get(None, {}))
+            kwargs = {name: kwargs[name] for name in pattern.pattern.converters}
+            with self.subTest(url=pattern.name):
+                self.assertQueryBudget(reverse(f'{namespace}:{pattern.name}', kwargs=kwargs),
+                                       budgets.get(pattern.name))
@@ -0,0 +1,86 @@
+import math
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_local = threading.local()
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+def current_replica():
+    return getattr(_local, 'replica', None)
+
+
+@contextmanager
+def use_primary():
+    """Read from the primary inside the block, e.g. to fill a cache that outlives the replication lag."""
+    replica = current_replica()
+    _local.replica = None
+    try:
+        yield
+    finally:
+        _local.replica = replica
+
+
+class ReplicaRouter(object):
+    """Send the reads of the views marked replica_reads to a read replica, everything else to the primary.
+
+    The replica of a request is picked by ReplicaMiddleware, which also keeps a client on the primary for
+    READ_REPLICAS['STICKY_SECONDS'] after it wrote something so it always reads its own writes.
+    """
+
+    def db_for_read(self, model, **hints):
+        replica = current_replica()
+        # Reads inside a transaction must see what it wrote
+        if replica is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return replica
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema through replication
+        return db not in settings.READ_REPLICAS.get('ALIASES')
+
+
+class ReplicaMiddleware(object):
+    """Pick the replica of the GET requests of replica_reads views and pin writers to the primary."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            response = self.get_response(request)
+        finally:
+            _local.replica = None
+        sticky_seconds = settings.READ_REPLICAS.get('STICKY_SECONDS')
+        if request.method not in SAFE_METHODS and settings.READ_REPLICAS.get('ALIASES') and sticky_seconds:
+            pinned_until = math.ceil(time.time() + sticky_seconds)
+            response.set_cookie(settings.READ_REPLICAS.get('COOKIE_NAME'), str(pinned_until),
+                                max_age=math.ceil(sticky_seconds), httponly=True, samesite='Lax')
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        aliases = settings.READ_REPLICAS.get('ALIASES')
+        view_class = getattr(view_func, 'view_class', None)
+        if aliases and request.method in SAFE_METHODS and getattr(view_class, 'replica_reads', False) \
+                and not self.is_pinned(request):
+            _local.replica = random.choice(aliases)
+
+    def is_pinned(self, request):
+        """True while the client may read rows it wrote that the replicas did not receive yet."""
+        try:
+            return float(request.COOKIES.get(settings.READ_REPLICAS.get('COOKIE_NAME'), 0)) > time.time()
+        except ValueError:
+            return False
@@ -0,0 +1,67 @@
+import gzip
+import logging
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+log = logging.getLogger(__name__)
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.json', '.svg', '.txt', '.xml', '.html', '.ico', '.eot', '.ttf', '.otf')
+# Variants that do not save at least 5% are not worth the extra lookup by the server
+MIN_COMPRESSION_RATIO = 0.95
+
+
+def compress(content):
+    """Return the (extension, bytes) variants worth storing next to a static file."""
+    variants = [('.gz', gzip.compress(content, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(content, quality=11)))
+    return [(extension, data) for extension, data in variants if len(data) < len(content) * MIN_COMPRESSION_RATIO]
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Manifest (content hashed) static files, each text asset stored with .gz and .br precompressed copies.
+
+    Brotli variants are only written when the optional brotli package is installed.
+    """
+
+    def url_converter(self, name, hashed_files, template=None):
+        converter = super().url_converter(name, hashed_files, template)
+
+        def tolerant_converter(matchobj):
+            try:
+                return converter(matchobj)
+            except ValueError:
+                # Vendored plugin stylesheets reference files that are not shipped, keep those urls unhashed
+                log.warning('%s references a missing file: %s', name, matchobj.group(0))
+                return matchobj.group(0)
+        return tolerant_converter
+
+    def post_process(self, paths, dry_run=False, **options):
+        # Stylesheets are yielded once per pass, compress only the final version of each file.
+        # Pages only link the hashed names, the unhashed copies are left uncompressed.
+        collected = {}
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if not isinstance(processed, Exception) and hashed_name:
+                collected[name] = hashed_name
+            yield name, hashed_name, processed
+        if dry_run:
+            return
+        for hashed_name in collected.values():
+            self.compress_file(hashed_name)
+
+    def compress_file(self, name):
+        if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+            return
+        with self.open(name) as original:
+            content = original.read()
+        for extension, data in compress(content):
+            path = name + extension
+            if self.exists(path):
+                self.delete(path)
+            self._save(path, ContentFile(data))